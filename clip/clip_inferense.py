@@ -1,9 +1,17 @@
-import io
-from PIL import Image
+from clip.embedding_bank import TextEmbeddingBank, file_sha256
+from clip.preprocess import CropPreprocessor
 from clip.mobileclip.translate import translation_dict
-from settings import logger
+from settings import (
+    CLIP_CACHE_DIR,
+    CLIP_DEFECT_THRESHOLD,
+    CLIP_MODEL_NAME,
+    CLIP_WEIGHTS_PATH,
+    logger,
+)
 from clip import mobileclip
+import numpy as np
 import torch
+from torchvision.transforms import CenterCrop
 filters = {
     "tree species": [
         "A photo of a Norway maple (Acer platanoides) tree.",
@@ -139,51 +147,27 @@ def clean_key(s: str) -> str:
     return s
 
 
-def process_image(
-    img,
-    model,
-    preprocess,
-    tokenizer,
+def parse_similarity(
+    similarity: torch.Tensor,
+    species_texts: list,
+    defect_texts: list,
     translation_dict: dict,
     problem_translation_dict: dict,
-    defect_threshold: float = 0.2
+    defect_threshold: float = 0.2,
 ) -> dict:
-
-    # Если передан путь вместо объекта Image
-    if isinstance(img, str):
-        img = Image.open(img).convert("RGB")
-
-    image_input = preprocess(img).unsqueeze(0)
-
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = model.to(device)
-    image_input = image_input.to(device)
-
-    # Разделяем классы
-    species_texts = list(translation_dict.keys())
-    defect_texts = list(problem_translation_dict.keys())
-    all_texts = species_texts + defect_texts
-
-    text_inputs = tokenizer(all_texts).to(device)
-
-    with torch.no_grad():
-        image_features = model.encode_image(image_input)
-        text_features = model.encode_text(text_inputs)
-
-        image_features = image_features / image_features.norm(dim=-1, keepdim=True)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-
-        similarity = (100.0 * image_features @ text_features.T).softmax(dim=-1)
-
+    '''
+    Разбирает вероятности одного изображения по всем промптам
+    (сначала виды, затем дефекты) в результат классификации.
+    '''
     # --- Определение вида растения ---
     num_species = len(species_texts)
-    species_scores = similarity[:, :num_species]
-    best_prob, best_idx = species_scores[0].max(dim=-1)
+    species_scores = similarity[:num_species]
+    best_prob, best_idx = species_scores.max(dim=-1)
     best_label = species_texts[best_idx]
 
     # --- Определение дефектов ---
-    defect_scores = similarity[:, num_species:]
-    top_probs, top_idx = torch.sort(defect_scores[0], descending=True)
+    defect_scores = similarity[num_species:]
+    top_probs, top_idx = torch.sort(defect_scores, descending=True)
 
     defects = []
     for prob, idx in zip(top_probs, top_idx):
@@ -290,16 +274,95 @@ def normalize_result(res: dict) -> dict:
     return normalized
 
 
-def get_clip_predict(crop_bytes):
-    model, _, preprocess = mobileclip.create_model_and_transforms('mobileclip_s1', pretrained=None)
-    tokenizer = mobileclip.get_tokenizer('mobileclip_s1')
-
-    state_dict = torch.load("models/mobileclip_s1_finetuned.pt", map_location='cpu')
-    model.load_state_dict(state_dict, strict=False)
-    model.eval()
-
-    img = Image.open(io.BytesIO(crop_bytes)).convert("RGB")
-    result = process_image(img, model, preprocess, tokenizer, translation_dict, problem_translation_dict, defect_threshold=0.1)
-    norm_result = normalize_result(result)
-
-    return norm_result
+class ClipClassifier:
+    '''
+    Классификатор вида растения и его дефектов на базе MobileCLIP.
+
+    Модель (уже репараметризованная), препроцессинг и токенайзер создаются
+    один раз на процесс и переиспользуются для всех кропов.
+    '''
+
+    def __init__(
+        self,
+        model_name: str = CLIP_MODEL_NAME,
+        weights_path: str = CLIP_WEIGHTS_PATH,
+        defect_threshold: float = CLIP_DEFECT_THRESHOLD,
+    ):
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model, _, preprocess = mobileclip.create_model_and_transforms(model_name, pretrained=None)
+        state_dict = torch.load(weights_path, map_location='cpu')
+        model.load_state_dict(state_dict, strict=False)
+        model.eval()
+
+        self.model = model.to(self.device)
+        self.preprocess = preprocess
+        image_size = next(t.size[0] for t in preprocess.transforms if isinstance(t, CenterCrop))
+        self.crop_preprocessor = CropPreprocessor(image_size)
+        self.tokenizer = mobileclip.get_tokenizer(model_name)
+        self.defect_threshold = defect_threshold
+
+        self.checkpoint_hash = file_sha256(weights_path)
+        self.text_bank = TextEmbeddingBank.load_or_build(
+            encode_texts=self.encode_texts,
+            prompt_sets={
+                "species": list(translation_dict.keys()),
+                "defects": list(problem_translation_dict.keys()),
+            },
+            checkpoint_hash=self.checkpoint_hash,
+            cache_dir=CLIP_CACHE_DIR,
+            model_name=model_name,
+        )
+        # На CPU тензор разделяет страницы memory map банка, без копии
+        self.text_features = torch.from_numpy(self.text_bank.embeddings).to(self.device)
+
+    def encode_texts(self, texts: list) -> np.ndarray:
+        '''
+        Считает текстовые эмбеддинги для списка промптов.
+        '''
+        with torch.no_grad():
+            text_inputs = self.tokenizer(texts).to(self.device)
+            text_features = self.model.encode_text(text_inputs)
+        return text_features.float().cpu().numpy()
+
+    def encode_images(self, images: torch.Tensor) -> torch.Tensor:
+        '''
+        Считает нормализованные эмбеддинги батча изображений [N, 3, H, W].
+        '''
+        with torch.no_grad():
+            image_features = self.model.encode_image(images.to(self.device))
+            image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+        return image_features
+
+    def encode_batch(self, images: list) -> list:
+        '''
+        Считает эмбеддинги списка кропов, уже приведённых к размеру входа
+        (CropPreprocessor.resize), одним проходом энкодера
+        (используется микро-батчером).
+        '''
+        batch = self.crop_preprocessor.to_tensor(np.stack(images))
+        return list(self.encode_images(batch).cpu())
+
+    def score(self, image_features: torch.Tensor) -> list:
+        '''
+        Сопоставляет эмбеддинги изображений с банком промптов одним
+        матричным умножением и возвращает нормализованные результаты.
+        '''
+        with torch.no_grad():
+            similarity = (100.0 * image_features.to(self.device) @ self.text_features.T).softmax(dim=-1)
+        similarity = similarity.cpu()
+
+        species_texts = self.text_bank.prompt_sets["species"]
+        defect_texts = self.text_bank.prompt_sets["defects"]
+        return [
+            normalize_result(
+                parse_similarity(
+                    row,
+                    species_texts,
+                    defect_texts,
+                    translation_dict,
+                    problem_translation_dict,
+                    defect_threshold=self.defect_threshold,
+                )
+            )
+            for row in similarity
+        ]
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from settings import logger
+from utils.fs_util import directory_lock
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    '''
+    Считает sha256 файла (например, чекпойнта модели) по частям.
+    '''
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompts_sha256(model_name: str, prompt_sets: Dict[str, List[str]]) -> str:
+    '''
+    Считает sha256 от имени модели и списков промптов (с учётом порядка).
+    '''
+    payload = json.dumps(
+        {"model": model_name, "prompts": prompt_sets},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TextEmbeddingBank:
+    '''
+    Банк нормализованных текстовых эмбеддингов для наборов промптов.
+
+    Эмбеддинги считаются один раз, сохраняются в .npy файл, имя которого
+    содержит хэш чекпойнта и хэш промптов, и при следующих запусках
+    открываются через memory map (copy-on-write, поэтому массив можно
+    передать в torch.from_numpy без копирования). Пересчёт происходит
+    только при изменении весов модели или промптов.
+    '''
+
+    file_prefix = "text_bank"
+
+    def __init__(self, prompt_sets: Dict[str, List[str]], embeddings: np.ndarray):
+        self.prompt_sets = prompt_sets
+        self.embeddings = embeddings
+        self.offsets: Dict[str, slice] = {}
+        start = 0
+        for name, prompts in prompt_sets.items():
+            self.offsets[name] = slice(start, start + len(prompts))
+            start += len(prompts)
+        if start != len(embeddings):
+            raise ValueError(
+                f"Количество эмбеддингов ({len(embeddings)}) не совпадает с "
+                f"количеством промптов ({start})"
+            )
+
+    @property
+    def texts(self) -> List[str]:
+        return [text for prompts in self.prompt_sets.values() for text in prompts]
+
+    def get(self, name: str) -> np.ndarray:
+        '''
+        Возвращает эмбеддинги набора промптов name.
+        '''
+        return self.embeddings[self.offsets[name]]
+
+    @classmethod
+    def get_bank_path(
+        cls,
+        cache_dir: str,
+        checkpoint_hash: str,
+        prompts_hash: str,
+    ) -> Path:
+        return Path(cache_dir) / (
+            f"{cls.file_prefix}_{checkpoint_hash[:16]}_{prompts_hash[:16]}.npy"
+        )
+
+    @classmethod
+    def load_or_build(
+        cls,
+        encode_texts: Callable[[List[str]], np.ndarray],
+        prompt_sets: Dict[str, List[str]],
+        checkpoint_hash: str,
+        cache_dir: str,
+        model_name: str,
+    ) -> "TextEmbeddingBank":
+        '''
+        Открывает сохранённый банк эмбеддингов или строит новый.
+
+        Args:
+            encode_texts: функция, возвращающая эмбеддинги [N, D] для списка текстов
+            prompt_sets: наборы промптов {имя набора: список текстов}
+            checkpoint_hash: хэш весов модели
+            cache_dir: директория для хранения банков
+            model_name: имя модели (входит в хэш промптов)
+        '''
+        prompts_hash = prompts_sha256(model_name, prompt_sets)
+        bank_path = cls.get_bank_path(cache_dir, checkpoint_hash, prompts_hash)
+
+        try:
+            with directory_lock(bank_path.parent, exclusive=False):
+                if bank_path.exists():
+                    embeddings = np.load(bank_path, mmap_mode="c")
+                    bank = cls(prompt_sets, embeddings)
+                    logger.info(f"Банк текстовых эмбеддингов загружен из {bank_path}")
+                    return bank
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось открыть банк эмбеддингов {bank_path}: {e}")
+
+        texts = [text for prompts in prompt_sets.values() for text in prompts]
+        embeddings = np.asarray(encode_texts(texts), dtype=np.float32)
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+        try:
+            # Старые банки удаляются под эксклюзивной блокировкой, чтобы не
+            # удалить файл, который другой воркер в этот момент открывает
+            with directory_lock(bank_path.parent, exclusive=True):
+                for stale_path in bank_path.parent.glob(f"{cls.file_prefix}_*.npy"):
+                    if stale_path != bank_path:
+                        stale_path.unlink()
+                tmp_path = bank_path.with_suffix(f".{os.getpid()}.tmp.npy")
+                np.save(tmp_path, embeddings)
+                os.replace(tmp_path, bank_path)
+            logger.info(f"Банк текстовых эмбеддингов сохранён в {bank_path}")
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить банк эмбеддингов {bank_path}: {e}")
+
+        return cls(prompt_sets, embeddings)
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from settings import (
+    CROP_CACHE_MAX_ITEMS,
+    CROP_CACHE_MAX_MB,
+    CROP_CACHE_TOLERANCE,
+    logger,
+)
+from utils.fs_util import commit_generation, directory_lock
+from utils.metrics_util import metrics
+
+
+def exact_hash(image: np.ndarray) -> int:
+    '''
+    64-битный хэш пикселей изображения (blake2b).
+    '''
+    digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+
+def perceptual_hash(image: np.ndarray) -> int:
+    '''
+    64-битный разностный перцептивный хэш (dHash): знаки разностей соседних
+    пикселей уменьшенного до 9x8 серого изображения. Почти одинаковые
+    кропы дают хэши с малым расстоянием Хэмминга.
+    '''
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class CropEmbeddingCache:
+    '''
+    Кэш эмбеддингов кропов для энкодера изображений CLIP.
+
+    Ключ - хэш пикселей кропа, уже приведённого к размеру входа CLIP: точный
+    (tolerance=0) или перцептивный dHash, при котором попаданием считается
+    любой сохранённый хэш на расстоянии Хэмминга не больше tolerance бит.
+    Нормализованные эмбеддинги хранятся в float16 в одном заранее
+    выделенном массиве [capacity, dim], вытеснение - LRU. Ёмкость
+    ограничена max_items и бюджетом памяти max_bytes.
+
+    Содержимое сохраняется в снимок (.npy, открывается через memory map) и
+    восстанавливается лениво: запись из снимка копируется в кэш только при
+    первом обращении к ней. Файлы снимка пишутся новым поколением, на
+    которое атомарно переключается crop_cache.json, поэтому хэши и
+    эмбеддинги разных снимков не смешиваются.
+    '''
+
+    snapshot_meta = "crop_cache.json"
+    snapshot_prefix = "crop_cache_"
+
+    def __init__(self, max_items: int = 20000, max_bytes: int = 64 * 1024 * 1024,
+                 tolerance: int = 0):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.tolerance = tolerance
+        self.capacity = 0
+        self._embeddings: Optional[np.ndarray] = None
+        self._hashes: Optional[np.ndarray] = None
+        self._slots: "OrderedDict[int, int]" = OrderedDict()
+        # Снимок, восстановленный при старте: хэши, эмбеддинги (mmap), индекс
+        self._snapshot_hashes: Optional[np.ndarray] = None
+        self._snapshot_embeddings: Optional[np.ndarray] = None
+        self._snapshot_index: dict = {}
+        self._snapshot_alive: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        metrics.gauge("crop_cache_items", lambda: len(self._slots))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0 and self.max_bytes > 0
+
+    def key(self, image: np.ndarray) -> int:
+        if self.tolerance > 0:
+            return perceptual_hash(image)
+        return exact_hash(image)
+
+    def _allocate(self, dim: int):
+        self.capacity = max(1, min(self.max_items, self.max_bytes // (dim * 2)))
+        self._embeddings = np.zeros((self.capacity, dim), dtype=np.float16)
+        self._hashes = np.zeros(self.capacity, dtype=np.uint64)
+        logger.info(
+            f"Кэш эмбеддингов кропов: {self.capacity} x {dim} float16 "
+            f"({self._embeddings.nbytes / 1024 / 1024:.1f} МБ)"
+        )
+
+    def _find(self, key: int) -> Optional[int]:
+        if key in self._slots:
+            return key
+        if self.tolerance <= 0 or not self._slots:
+            return None
+        size = len(self._slots)
+        distances = np.bitwise_count(self._hashes[:size] ^ np.uint64(key))
+        slot = int(np.argmin(distances))
+        if distances[slot] > self.tolerance:
+            return None
+        return int(self._hashes[slot])
+
+    def _find_in_snapshot(self, key: int) -> Optional[int]:
+        if not self._snapshot_index:
+            return None
+        row = self._snapshot_index.get(key)
+        if row is not None or self.tolerance <= 0:
+            return row
+        distances = np.bitwise_count(self._snapshot_hashes ^ np.uint64(key))
+        # Уже перенесённые в кэш записи снимка не учитываются
+        distances[~self._snapshot_alive] = 255
+        row = int(np.argmin(distances))
+        if distances[row] > self.tolerance:
+            return None
+        return row
+
+    def _put(self, key: int, embedding: np.ndarray):
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if self._embeddings is None:
+            self._allocate(embedding.shape[0])
+        if key in self._slots:
+            slot = self._slots[key]
+            self._slots.move_to_end(key)
+        elif len(self._slots) < self.capacity:
+            slot = len(self._slots)
+            self._slots[key] = slot
+        else:
+            # Вытесняем давно не использованный кроп и занимаем его слот
+            _, slot = self._slots.popitem(last=False)
+            self._slots[key] = slot
+            metrics.inc("crop_cache_evictions")
+        self._embeddings[slot] = embedding
+        self._hashes[slot] = np.uint64(key)
+
+    def get_many(self, keys: List[int]) -> List[Optional[np.ndarray]]:
+        '''
+        Возвращает эмбеддинги (float32) для ключей, None для промахов.
+        '''
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        if not self.enabled:
+            return results
+        with self._lock:
+            for i, key in enumerate(keys):
+                found = self._find(key)
+                if found is not None:
+                    self._slots.move_to_end(found)
+                    results[i] = self._embeddings[self._slots[found]].astype(np.float32)
+                    continue
+                row = self._find_in_snapshot(key)
+                if row is not None:
+                    # Ленивое восстановление: запись снимка переносится в кэш
+                    stored_key = int(self._snapshot_hashes[row])
+                    results[i] = np.array(self._snapshot_embeddings[row], dtype=np.float32)
+                    self._snapshot_index.pop(stored_key, None)
+                    self._snapshot_alive[row] = False
+                    self._put(stored_key, results[i])
+                    metrics.inc("crop_cache_restored")
+        hits = sum(result is not None for result in results)
+        metrics.inc("crop_cache_hits", hits)
+        metrics.inc("crop_cache_misses", len(keys) - hits)
+        return results
+
+    def put_many(self, keys: List[int], embeddings: List[np.ndarray]):
+        if not self.enabled:
+            return
+        with self._lock:
+            for key, embedding in zip(keys, embeddings):
+                self._put(key, embedding)
+
+    def snapshot(self, directory: str, version: str) -> int:
+        '''
+        Сохраняет содержимое кэша в directory (от старых записей к новым).
+        Ещё не восстановленные записи прошлого снимка сохраняются первыми.
+
+        Returns:
+            int: количество сохранённых записей
+        '''
+        with self._lock:
+            hashes, embeddings = [], []
+            if self._snapshot_index:
+                rows = sorted(self._snapshot_index.values())
+                hashes.append(self._snapshot_hashes[rows])
+                embeddings.append(np.asarray(self._snapshot_embeddings[rows]))
+            if self._slots:
+                slots = list(self._slots.values())
+                hashes.append(self._hashes[slots])
+                embeddings.append(self._embeddings[slots])
+        if not hashes:
+            return 0
+        hashes = np.concatenate(hashes)
+        embeddings = np.concatenate(embeddings).astype(np.float16)
+        if self.capacity:
+            hashes, embeddings = hashes[-self.capacity:], embeddings[-self.capacity:]
+
+        directory = Path(directory)
+        generation = uuid.uuid4().hex[:12]
+        with directory_lock(directory, exclusive=True):
+            np.save(directory / f"{self.snapshot_prefix}hashes.{generation}.npy", hashes)
+            np.save(directory / f"{self.snapshot_prefix}embeddings.{generation}.npy", embeddings)
+            commit_generation(directory, self.snapshot_meta, {
+                "version": version,
+                "generation": generation,
+                "count": len(hashes),
+            }, self.snapshot_prefix)
+        return len(hashes)
+
+    def restore(self, directory: str, version: str) -> int:
+        '''
+        Подключает снимок из directory, если он сделан для той же версии
+        модели. Эмбеддинги открываются через memory map и копируются в кэш
+        при первом обращении.
+
+        Returns:
+            int: количество доступных записей снимка
+        '''
+        directory = Path(directory)
+        try:
+            with directory_lock(directory, exclusive=False):
+                meta = json.loads((directory / self.snapshot_meta).read_text(encoding="utf-8"))
+                if meta.get("version") != version:
+                    logger.info("Снимок кэша эмбеддингов кропов устарел, пропускаю")
+                    return 0
+                generation = meta["generation"]
+                hashes = np.load(directory / f"{self.snapshot_prefix}hashes.{generation}.npy")
+                embeddings = np.load(
+                    directory / f"{self.snapshot_prefix}embeddings.{generation}.npy",
+                    mmap_mode="r",
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.info(f"Снимок кэша эмбеддингов кропов не загружен: {e}")
+            return 0
+        if not len(hashes) == len(embeddings) == meta.get("count"):
+            logger.warning("Снимок кэша эмбеддингов кропов повреждён, пропускаю")
+            return 0
+        with self._lock:
+            self._snapshot_hashes = hashes
+            self._snapshot_embeddings = embeddings
+            self._snapshot_index = {int(key): row for row, key in enumerate(hashes)}
+            self._snapshot_alive = np.ones(len(hashes), dtype=bool)
+        return len(hashes)
+
+    def clear(self):
+        '''
+        Очищает кэш (например, при загрузке других весов CLIP).
+        '''
+        with self._lock:
+            self._slots.clear()
+            if self._hashes is not None:
+                self._hashes[:] = 0
+            self._snapshot_hashes = None
+            self._snapshot_embeddings = None
+            self._snapshot_index = {}
+            self._snapshot_alive = None
+
+    def on_model_loaded(self, name: str):
+        if name == "classifier" and (self._slots or self._snapshot_index):
+            self.clear()
+            logger.info("Кэш эмбеддингов кропов сброшен после загрузки CLIP")
+
+
+crop_embedding_cache = CropEmbeddingCache(
+    max_items=CROP_CACHE_MAX_ITEMS,
+    max_bytes=CROP_CACHE_MAX_MB * 1024 * 1024,
+    tolerance=CROP_CACHE_TOLERANCE,
+)
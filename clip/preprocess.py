@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+import torch
+
+
+class CropPreprocessor:
+    '''
+    Препроцессинг кропов для энкодера изображений MobileCLIP на numpy/OpenCV.
+
+    Повторяет Resize(image_size) + CenterCrop(image_size) + ToTensor из
+    mobileclip.create_model_and_transforms, но работает напрямую с BGR
+    uint8 массивами: кроп масштабируется cv2.resize и обрезается до
+    центрального квадрата (resize, по одному кропу - результат нужен и для
+    ключа crop_embedding_cache), а смена каналов BGR -> RGB, перестановка
+    осей и масштабирование в [0, 1] выполняются одной векторной операцией
+    над батчем, собранным микро-батчером (to_tensor).
+    '''
+
+    def __init__(self, image_size: int = 256):
+        self.image_size = image_size
+
+    def resize(self, crop: np.ndarray) -> np.ndarray:
+        '''
+        Масштабирование кропа по короткой стороне до image_size и вырезание
+        центрального квадрата.
+
+        Args:
+            crop: BGR кроп [H, W, 3] uint8
+
+        Returns:
+            np.ndarray: BGR изображение [image_size, image_size, 3] uint8
+        '''
+        size = self.image_size
+        height, width = crop.shape[:2]
+        # Размер после Resize(size) считается так же, как в torchvision
+        if height <= width:
+            new_height, new_width = size, int(size * width / height)
+        else:
+            new_height, new_width = int(size * height / width), size
+
+        # INTER_AREA при уменьшении ближе всего к bilinear с antialias
+        interpolation = cv2.INTER_AREA if min(height, width) > size else cv2.INTER_LINEAR
+        resized = cv2.resize(crop, (new_width, new_height), interpolation=interpolation)
+
+        top = int(round((new_height - size) / 2.0))
+        left = int(round((new_width - size) / 2.0))
+        return np.ascontiguousarray(resized[top:top + size, left:left + size])
+
+    def to_tensor(self, batch: np.ndarray) -> torch.Tensor:
+        '''
+        Батч BGR uint8 [N, H, W, 3] -> RGB float32 [N, 3, H, W] в [0, 1].
+        '''
+        return (
+            torch.from_numpy(batch)
+            .flip(-1)
+            .permute(0, 3, 1, 2)
+            .float()
+            .div_(255.0)
+            .contiguous()
+        )
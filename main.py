@@ -1,14 +1,68 @@
+import asyncio
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional
 
 from fastapi import Depends, FastAPI, Header, HTTPException, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
 
-from schemas.schemas import HealthResponse, ScanResponse
-from settings import ML_TOKEN, logger
-from utils.predict_util import get_predict
-app = FastAPI()
+from clip.embedding_cache import crop_embedding_cache
+from schemas.schemas import HealthResponse, PredictSchema, ScanJobResponse, ScanResponse
+from settings import ML_TOKEN, UPLOAD_MODE, logger
+from utils.cache_util import content_hash, result_cache, scan_flights
+from utils.encode_util import image_encoder
+from utils.executor_util import inference_executor
+from utils.image_util import check_image_header, decode_image
+from utils.job_util import JobQueueFull, scan_jobs
+from utils.metrics_util import metrics
+from utils.models_util import registry
+from utils.s3_util import s3_manager
+from utils.snapshot_util import cache_snapshotter
+from utils.upload_util import upload_queue
+from utils.predict_util import (
+    clip_batcher,
+    detector_batcher,
+    drain_annotations,
+    get_predict,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Кэши сбрасываются при загрузке моделей с другими весами
+    registry.add_listener(result_cache.refresh_version)
+    registry.add_listener(crop_embedding_cache.on_model_loaded)
+    # Результаты с незагруженными файлами удаляются из кэша
+    upload_queue.add_failure_listener(result_cache.evict_object)
+    if inference_executor.kind != "process":
+        logger.info("Загрузка моделей")
+        registry.load_all()
+    inference_executor.start()
+    image_encoder.start()
+    await detector_batcher.start()
+    await clip_batcher.start()
+    await asyncio.to_thread(result_cache.refresh_version)
+    await cache_snapshotter.start()
+    await s3_manager.start()
+    if UPLOAD_MODE == "queue":
+        await upload_queue.start()
+    await scan_jobs.start(run_scan_job)
+    yield
+    await scan_jobs.stop()
+    await drain_annotations()
+    await upload_queue.stop()
+    await s3_manager.close()
+    await cache_snapshotter.stop()
+    result_cache.close()
+    await clip_batcher.stop()
+    await detector_batcher.stop()
+    image_encoder.shutdown()
+    inference_executor.shutdown()
+    registry.clear()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,10 +85,16 @@ app.add_middleware(
 async def health():
     return HealthResponse(
         status="healthy",
-        timestamp=datetime.now().isoformat()
+        timestamp=datetime.now().isoformat(),
+        models=registry.load_times,
     )
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+
 def verify_ml_token(ml_token: Optional[str] = Header(None)):
     """Проверка ML токена"""
     if not ml_token or ml_token != ML_TOKEN:
@@ -42,10 +102,37 @@ def verify_ml_token(ml_token: Optional[str] = Header(None)):
     return True
 
 
+async def run_scan(
+    cache_key: str,
+    request_id: str,
+    framed: bool,
+    image_bytes: bytes,
+) -> PredictSchema:
+    """
+    Скан фото с сохранением результата в кэш. Повторы того же фото,
+    пришедшие во время скана, ждут его результат.
+    """
+    async def scan_once():
+        try:
+            image = await inference_executor.run(decode_image, image_bytes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        result = await get_predict(image, request_id, framed=framed)
+        await result_cache.set(cache_key, result, request_id=request_id)
+        return result
+
+    return await scan_flights.do(cache_key, scan_once)
+
+
+async def run_scan_job(payload: dict) -> PredictSchema:
+    return await run_scan(**payload)
+
+
 @app.post("/scan", response_model=ScanResponse)
 async def scan(
     file: UploadFile,
     request_id: str = Form(...),
+    framed: bool = Form(True),
     token_verified: bool = Depends(verify_ml_token),
 ):
 
@@ -54,7 +141,14 @@ async def scan(
     logger.info(f"Начат процесс сканирования: {scan_id}")
     try:
         image_bytes = await file.read()
-        predict = await get_predict(image_bytes, request_id)
+        cache_key = result_cache.make_key(
+            await asyncio.to_thread(content_hash, image_bytes), framed=framed
+        )
+        predict = await result_cache.get(cache_key)
+        if predict is not None:
+            logger.info(f"Результат скана {scan_id} взят из кэша")
+        else:
+            predict = await run_scan(cache_key, request_id, framed, image_bytes)
         response = ScanResponse(
             id=scan_id,
             predict=predict,
@@ -62,5 +156,57 @@ async def scan(
         logger.warning(f"ML RESPONSE: {response}")
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error {str(e)}")
+
+
+@app.post("/scan/jobs", response_model=ScanJobResponse, status_code=202)
+async def submit_scan_job(
+    file: UploadFile,
+    request_id: str = Form(...),
+    framed: bool = Form(True),
+    token_verified: bool = Depends(verify_ml_token),
+):
+    """
+    Асинхронный скан: фото проверяется и ставится в очередь, ответ с ID
+    задачи возвращается сразу. Результат - GET /scan/jobs/{job_id}.
+    """
+    logger.info(f"Получена задача скана от API: {request_id}")
+    image_bytes = await file.read()
+    cache_key = result_cache.make_key(
+        await asyncio.to_thread(content_hash, image_bytes), framed=framed
+    )
+    predict = await result_cache.get(cache_key)
+    try:
+        if predict is not None:
+            job = scan_jobs.submit(result=predict)
+        else:
+            # Полное декодирование выполняется в воркере задачи, здесь -
+            # только проверка заголовка, чтобы не ждать очереди инференса
+            try:
+                check_image_header(image_bytes)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            job = scan_jobs.submit({
+                "cache_key": cache_key,
+                "request_id": request_id,
+                "framed": framed,
+                "image_bytes": image_bytes,
+            }, size=len(image_bytes))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    logger.info(f"Задача скана {job.id} ({job.status.value}) для запроса {request_id}")
+    return job
+
+
+@app.get("/scan/jobs/{job_id}", response_model=ScanJobResponse)
+async def get_scan_job(
+    job_id: str,
+    token_verified: bool = Depends(verify_ml_token),
+):
+    job = scan_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена или её результат устарел")
+    return job
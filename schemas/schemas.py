@@ -1,14 +1,19 @@
 from enum import Enum
 from typing import List, Optional, Dict
 
-import cv2
 import numpy as np
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+from utils.image_util import DecodedImage, decode_image
 
 
 class HealthResponse(BaseModel):
     status: str
     timestamp: str
+    models: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Загруженные модели и время их загрузки, сек."
+    )
 
 class ScanRequestSchema(BaseModel):
     request_id: str
@@ -20,15 +25,19 @@ class APIRequestSchema(BaseModel):
     request_id: str
     user_id: str
     file: Optional[str] = None
+    image_file: Optional[bytes] = Field(default=None, exclude=True)
+    image: Optional[DecodedImage] = Field(
+        default=None,
+        exclude=True,
+        description="Декодированное при валидации изображение, "
+                    "передаётся дальше без повторного декодирования"
+    )
 
     @model_validator(mode='after')
     def validate_image_file(self):
-        if self.image_file:
+        if self.image_file and self.image is None:
             try:
-                np_arr = np.frombuffer(self.image_file, np.uint8)
-                img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-                if img is None:
-                    raise ValueError("Некорректные байты изображения")
+                self.image = decode_image(self.image_file)
             except Exception as e:
                 raise ValueError(f"Некорректные байты изображения: {e}")
         return self
@@ -43,6 +52,26 @@ class ScanResponse(BaseModel):
 
 
 
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ScanJobResponse(BaseModel):
+    """
+    Состояние асинхронной задачи скана. result заполняется, когда
+    задача выполнена (status=done), error - когда она завершилась ошибкой.
+    """
+    id: str = Field(description="ID задачи, он же ID сканирования")
+    status: JobStatus
+    created_at: str
+    finished_at: Optional[str] = None
+    result: Optional[ScanResponse] = None
+    error: Optional[str] = None
+
+
 class DetectorSchema(BaseModel):
     crops: list["Crop"] = []
     framed_url: Optional[str] = Field(
@@ -94,9 +123,19 @@ class Plant(BaseModel):
 
 
 class Crop(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     id: int = Field(..., ge=0, description="Идентификатор кропа в пределах "
                                            "одной фотографии")
-    crop_bytes: bytes
+    crop_bytes: Optional[bytes] = Field(
+        default=None,
+        description="Кроп в JPEG (только для загрузки в S3)"
+    )
+    crop_image: Optional[np.ndarray] = Field(
+        default=None,
+        exclude=True,
+        description="Кроп в BGR (view исходного изображения) для классификации"
+    )
     url_image: str
 
 class ClipReturnSchema(BaseModel):
@@ -0,0 +1,90 @@
+'''
+Бенчмарк отрисовки разметки: покадровое смешивание на каждый объект
+(прежняя реализация _process_results) против однопроходного
+render_annotations.
+
+Запуск:
+    python -m segmentator.benchmark_render --width 4000 --height 3000
+'''
+import argparse
+import time
+from typing import List
+
+import cv2
+import numpy as np
+
+from segmentator.segmentator_inferense import render_annotations
+
+
+def render_annotations_sequential(image: np.ndarray, boxes: np.ndarray,
+                                  labels: List[str], colors: List[tuple],
+                                  contours: List[tuple], alpha: float = 0.4) -> np.ndarray:
+    '''
+    Прежняя отрисовка: копия кадра и cv2.addWeighted по всему кадру
+    на каждый объект. Оставлена как эталон для сравнения.
+    '''
+    labeled_image = image.copy()
+    for i, (x1, y1, x2, y2) in enumerate(boxes):
+        color = colors[i]
+        overlay = labeled_image.copy()
+        cv2.drawContours(overlay, contours[i], -1, color, thickness=-1)
+        labeled_image = cv2.addWeighted(overlay, alpha, labeled_image, 1 - alpha, 0)
+        cv2.drawContours(labeled_image, contours[i], -1, color, 2)
+        cv2.rectangle(labeled_image, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+        cv2.putText(labeled_image, labels[i], (int(x1), int(y1) - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
+    return labeled_image
+
+
+def make_scene(width: int, height: int, num_objects: int, seed: int = 0):
+    '''
+    Синтетический кадр с эллиптическими «кронами» в случайных местах.
+    '''
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    boxes, labels, colors, contours = [], [], [], []
+    for i in range(num_objects):
+        w = int(rng.integers(width // 20, width // 6))
+        h = int(rng.integers(height // 20, height // 6))
+        x1 = int(rng.integers(0, width - w))
+        y1 = int(rng.integers(0, height - h))
+        mask = np.zeros((h, w), dtype=np.uint8)
+        cv2.ellipse(mask, (w // 2, h // 2), (w // 2 - 1, h // 2 - 1), 0, 0, 360, 1, -1)
+        object_contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL,
+                                              cv2.CHAIN_APPROX_SIMPLE, offset=(x1, y1))
+        boxes.append((x1, y1, x1 + w, y1 + h))
+        labels.append(f"id={i}, tree")
+        colors.append(tuple(int(c) for c in rng.integers(0, 256, 3)))
+        contours.append(object_contours)
+    return image, np.array(boxes), labels, colors, contours
+
+
+def measure(func, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--objects", type=int, nargs="+", default=[1, 5, 10, 25, 50, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"Кадр {args.width}x{args.height}")
+    print(f"{'объектов':>9} {'прежняя, мс':>12} {'один проход, мс':>16} {'ускорение':>10}")
+    for num_objects in args.objects:
+        scene = make_scene(args.width, args.height, num_objects)
+        sequential = measure(render_annotations_sequential, *scene, repeat=args.repeat)
+        single_pass = measure(render_annotations, *scene, repeat=args.repeat)
+        print(f"{num_objects:>9} {sequential:>12.1f} {single_pass:>16.1f} "
+              f"{sequential / single_pass:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,40 +9,275 @@ from fastapi import HTTPException
 from ultralytics import YOLO
 
 from settings import INF_CONF, INF_IOU, logger
+from utils.image_util import DecodedImage, decode_image
 from pathlib import Path
 
 
+def resolve_weights_path(weights_path: str = None) -> Path:
+    '''
+    Возвращает путь до весов YOLO модели (.pt файл).
+    Если путь не передан, берётся INF_MODEL_PATH или альтернативные пути.
+    '''
+    model_file_name = "best.pt"
+    default_model_path = os.getenv(f'INF_MODEL_PATH', f'./models/{model_file_name}')
+    weights_path = weights_path if weights_path is not None else (
+        default_model_path)
+    model_path = Path(weights_path)
+    if not model_path.exists():
+        alternative_paths = [
+            f"./models/{model_file_name}",
+            f"../models/{model_file_name}",
+            f"/app/models/{model_file_name}"
+        ]
+        for alt_path in alternative_paths:
+            if Path(alt_path).exists():
+                model_path = Path(alt_path)
+                logger.info(f"Модель найдена по альтернативному пути: {alt_path}")
+                break
+        else:
+            raise FileNotFoundError(f"Модель не найдена. Проверенные пути: {alternative_paths}")
+    return model_path
+
+
+def load_yolo_model(weights_path: str = None) -> YOLO:
+    '''
+    Загружает YOLO модель и переносит её на доступное устройство.
+    Вызывается один раз на процесс (см. utils.models_util.registry).
+    '''
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = YOLO(resolve_weights_path(weights_path))
+    model.to(device)
+    return model
+
+
+class DetectionResult:
+    '''
+    Результат детекции для одного изображения в numpy.
+
+    Маски (если есть) покрывают ровно всё изображение без паддинга
+    letterbox, в своём (обычно меньшем) разрешении. Объект лёгкий: в отличие
+    от ultralytics Results не держит исходное изображение, поэтому дёшево
+    передаётся между процессами.
+    '''
+
+    def __init__(self, boxes: np.ndarray, confidences: np.ndarray,
+                 classes: np.ndarray, names: Dict[int, str],
+                 orig_shape: tuple, masks: np.ndarray = None):
+        self.boxes = boxes  # [N, 4] xyxy в координатах изображения
+        self.confidences = confidences  # [N]
+        self.classes = classes  # [N] int
+        self.names = names
+        self.orig_shape = orig_shape  # (H, W)
+        self.masks = masks  # [N, mh, mw] или None
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @classmethod
+    def from_yolo(cls, res) -> "DetectionResult":
+        '''
+        Конвертирует ultralytics Results. Из масок убирается паддинг
+        letterbox, чтобы они совпадали с изображением (при батче изображений
+        разного размера паддинг доходит до квадрата imgsz x imgsz).
+        '''
+        orig_shape = tuple(res.orig_shape)
+        if res.boxes is None or len(res.boxes) == 0:
+            return cls(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32),
+                       np.zeros(0, dtype=int), res.names, orig_shape)
+
+        masks = None
+        if res.masks is not None:
+            masks = res.masks.data.cpu().numpy()
+            mask_h, mask_w = masks.shape[1:]
+            gain = min(mask_h / orig_shape[0], mask_w / orig_shape[1])
+            pad_w = (mask_w - orig_shape[1] * gain) / 2
+            pad_h = (mask_h - orig_shape[0] * gain) / 2
+            top, left = int(pad_h), int(pad_w)
+            bottom, right = int(mask_h - pad_h), int(mask_w - pad_w)
+            masks = masks[:, top:bottom, left:right]
+
+        return cls(
+            boxes=res.boxes.xyxy.cpu().numpy(),
+            confidences=res.boxes.conf.cpu().numpy(),
+            classes=res.boxes.cls.cpu().numpy().astype(int),
+            names=res.names,
+            orig_shape=orig_shape,
+            masks=masks,
+        )
+
+
+def run_detection(model: YOLO, images: Union[np.ndarray, List[np.ndarray]],
+                  imgsz: int = 640, iou: float = 0.65, conf: float = 0.2,
+                  verbose: bool = False) -> list:
+    '''
+    Запуск YOLO на одном изображении или списке изображений (батч).
+    Возвращает список DetectionResult в порядке входных изображений.
+    '''
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    results = model(images, imgsz=imgsz, iou=iou, conf=conf, verbose=verbose,
+                    device=device)
+    return [DetectionResult.from_yolo(res) for res in results]
+
+
+def encode_image(image: np.ndarray, image_format: str = 'jpg',
+                 quality: int = 95) -> bytes | None:
+    '''
+    Кодирует BGR изображение (или кроп) в bytes.
+
+    Args:
+        image: изображение в BGR
+        image_format: формат изображения ('jpg', 'png')
+        quality: качество для JPEG (0-100)
+
+    Returns:
+        bytes: закодированное изображение или None при ошибке
+    '''
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality] if image_format.lower() == 'jpg' else []
+
+    if image_format.lower() in ['jpg', 'jpeg']:
+        success, encoded_image = cv2.imencode('.jpg', image, encode_param)
+    elif image_format.lower() == 'png':
+        success, encoded_image = cv2.imencode('.png', image)
+    else:
+        logger.error(f"Неподдерживаемый формат: {image_format}")
+        success = False
+
+    if success:
+        return encoded_image.tobytes()
+    return None
+
+
+def warmup_yolo_model(model: YOLO, imgsz: int = 640):
+    '''
+    Прогрев модели: первый вызов YOLO создаёт predictor и сливает (fuse)
+    слои модели. Нужен до fork воркеров, чтобы они разделяли уже готовые веса.
+    '''
+    run_detection(model, np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz)
+
+
+def mask_roi_contours(mask: np.ndarray, box: np.ndarray, image_shape: tuple) -> tuple:
+    '''
+    Контуры маски объекта в координатах изображения.
+
+    Маска низкого разрешения покрывает всё изображение, но объект занимает
+    только свой bbox (YOLO обнуляет маску вне бокса). Поэтому
+    масштабируется и бинаризуется только область маски под bbox, а контуры
+    ищутся в этой области и сдвигаются в координаты изображения. Объём
+    работы пропорционален размеру объекта, а не фото.
+
+    Args:
+        mask: маска [mh, mw] в разрешении модели
+        box: bbox объекта xyxy в координатах изображения
+        image_shape: размер изображения (H, W, ...)
+
+    Returns:
+        tuple: контуры, как у cv2.findContours
+    '''
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return ()
+    height, width = image_shape[:2]
+    mask_h, mask_w = mask.shape[:2]
+    scale_x, scale_y = mask_w / width, mask_h / height
+
+    # Область маски под bbox, округлённая наружу до целых пикселей маски
+    mx1 = max(0, int(np.floor(box[0] * scale_x)))
+    my1 = max(0, int(np.floor(box[1] * scale_y)))
+    mx2 = min(mask_w, int(np.ceil(box[2] * scale_x)))
+    my2 = min(mask_h, int(np.ceil(box[3] * scale_y)))
+    if mx2 <= mx1 or my2 <= my1:
+        return ()
+
+    # Та же область в координатах изображения
+    x1, y1 = int(round(mx1 / scale_x)), int(round(my1 / scale_y))
+    x2 = min(width, int(round(mx2 / scale_x)))
+    y2 = min(height, int(round(my2 / scale_y)))
+    if x2 <= x1 or y2 <= y1:
+        return ()
+
+    roi = cv2.resize(mask[my1:my2, mx1:mx2], (x2 - x1, y2 - y1),
+                     interpolation=cv2.INTER_NEAREST)
+    roi = (roi > 0.5).astype(np.uint8)
+    mask_contours, _ = cv2.findContours(roi, cv2.RETR_EXTERNAL,
+                                        cv2.CHAIN_APPROX_SIMPLE, offset=(x1, y1))
+    return mask_contours
+
+
+def render_annotations(image: np.ndarray, boxes: np.ndarray, labels: List[str],
+                       colors: List[tuple], contours: List[tuple] = None,
+                       alpha: float = 0.4) -> np.ndarray:
+    '''
+    Рисует разметку за один проход по кадру.
+
+    Заливки всех масок рисуются в один цветной слой (при пересечении
+    сверху оказывается объект с большим индексом) и общую маску, после чего
+    слой смешивается с изображением одним cv2.addWeighted и копируется
+    только внутри масок. Смешивание ограничено общей рамкой всех масок, его
+    стоимость не зависит от количества объектов. Контуры, рамки и подписи
+    рисуются поверх.
+
+    Args:
+        image: изображение в BGR (не изменяется)
+        boxes: боксы [N, 4] xyxy (int)
+        labels: подписи объектов
+        colors: BGR цвета объектов
+        contours: контуры масок объектов в координатах изображения или None
+        alpha: прозрачность заливки масок
+
+    Returns:
+        np.ndarray: размеченное изображение
+    '''
+    labeled_image = image.copy()
+
+    if contours:
+        points = [c for object_contours in contours for c in object_contours]
+        if points:
+            # Общая рамка всех масок: за её пределами кадр не меняется
+            rx, ry, rw, rh = cv2.boundingRect(np.concatenate(points))
+            roi = labeled_image[ry:ry + rh, rx:rx + rw]
+            color_layer = roi.copy()
+            fill_mask = np.zeros(roi.shape[:2], dtype=np.uint8)
+            for i, object_contours in enumerate(contours):
+                cv2.drawContours(color_layer, object_contours, -1, colors[i],
+                                 thickness=-1, offset=(-rx, -ry))
+                cv2.drawContours(fill_mask, object_contours, -1, 255,
+                                 thickness=-1, offset=(-rx, -ry))
+            blended = cv2.addWeighted(color_layer, alpha, roi, 1 - alpha, 0)
+            cv2.copyTo(blended, fill_mask, roi)
+        for i, object_contours in enumerate(contours):
+            cv2.drawContours(labeled_image, object_contours, -1, colors[i], 2)
+
+    for (x1, y1, x2, y2), label, color in zip(boxes, labels, colors):
+        # Bounding box
+        cv2.rectangle(labeled_image, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+
+        # Подпись
+        cv2.putText(labeled_image, label, (int(x1), int(y1) - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
+
+    return labeled_image
+
+
 class ObjectDetector:
-    def __init__(self, weights_path: str = None):
+    def __init__(self, weights_path: str = None, model: YOLO = None):
         '''
         Класс для детекции и сегментации объектов с помощью YOLO.
-        путь до весов модели (.pt файл)
+        путь до весов модели (.pt файл) или уже загруженная модель.
+        Модель загружается при первом обращении, поэтому постобработка
+        готовых результатов (set_results) не требует весов.
         '''
-        # Проверяем модель
-        model_file_name = "best.pt"
-        default_model_path = os.getenv(f'INF_MODEL_PATH', f'./models/{model_file_name}')
-        weights_path = weights_path if weights_path is not None else (
-            default_model_path)
-        model_path = Path(weights_path)
-        if not model_path.exists():
-            alternative_paths = [
-                f"./models/{model_file_name}",
-                f"../models/{model_file_name}",
-                f"/app/models/{model_file_name}"
-            ]
-            for alt_path in alternative_paths:
-                if Path(alt_path).exists():
-                    weights_path = Path(alt_path)
-                    logger.info(f"Модель найдена по альтернативному пути: {alt_path}")
-                    break
-            else:
-                raise FileNotFoundError(f"Модель не найдена. Проверенные пути: {alternative_paths}")
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model = YOLO(weights_path)
-        self.model.to(self.device)
+        self.weights_path = weights_path
+        self._model = model
         self.objects_info = []
+        self._labeled_image = None
+
+    @property
+    def model(self) -> YOLO:
+        if self._model is None:
+            self._model = load_yolo_model(self.weights_path)
+        return self._model
 
-    def predict(self, image_input: Union[str, bytes], imgsz: int = 640,
+    def predict(self, image_input: Union[str, bytes, DecodedImage], imgsz: int = 640,
                 iou: float = 0.65, conf: float = 0.2,
                 verbose: bool =
                 False):
@@ -50,7 +285,8 @@ class ObjectDetector:
         Запуск инференса модели на изображении.
 
         Args:
-            image_input: путь до изображения или bytes изображения
+            image_input: путь до изображения, bytes или уже декодированное
+                изображение
             imgsz: размер изображения для модели
             iou: порог IoU
             conf: порог уверенности
@@ -62,8 +298,26 @@ class ObjectDetector:
 
         iou = iou if iou is not None else default_iou
         conf = conf if conf is not None else default_conf
-        # Загрузка изображения в зависимости от типа входных данных
 
+        if self.load_image(image_input) is None:
+            return None
+
+        results = run_detection(self.model, self.image, imgsz=imgsz, iou=iou,
+                                conf=conf, verbose=verbose)
+        return self.set_results(results[0])
+
+    def load_image(self, image_input: Union[str, bytes, DecodedImage]) -> np.ndarray | None:
+        '''
+        Загружает изображение для детекции.
+
+        Args:
+            image_input: путь до изображения, bytes или уже декодированное
+                изображение (повторно не декодируется)
+
+        Returns:
+            np.ndarray: изображение в BGR или None, если загрузить не удалось
+        '''
+        # Загрузка изображения в зависимости от типа входных данных
         if isinstance(image_input, str):
             # Вход - путь к файлу
             self.image = cv2.imread(image_input)
@@ -72,23 +326,38 @@ class ObjectDetector:
                 return None
         elif isinstance(image_input, bytes):
             # Вход - bytes
-            nparr = np.frombuffer(image_input, np.uint8)
-            self.image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            if self.image is None:
+            try:
+                decoded_image = decode_image(image_input)
+            except ValueError:
                 raise HTTPException(400, "Не удалось декодировать изображение из bytes")
-                logger.error("Не удалось декодировать изображение из bytes")
-                return None
+            self.image = decoded_image.array
+        elif isinstance(image_input, DecodedImage):
+            # Вход - уже декодированное изображение
+            self.image = image_input.array
         else:
-            logger.error("Неверный тип входных данных. Ожидается str (путь) или bytes")
+            logger.error("Неверный тип входных данных. Ожидается str (путь), "
+                         "bytes или DecodedImage")
             return None
 
         # Сохраняем оригинальные bytes для возможного повторного использования
         self.original_input = image_input
+        return self.image
+
+    def set_results(self, res) -> List[Dict[str, Any]] | None:
+        '''
+        Принимает результат детекции для загруженного изображения (в том
+        числе полученный из батча нескольких запросов или тайлового режима)
+        и обрабатывает его.
 
-        results = self.model(self.image, imgsz=imgsz, iou=iou, conf=conf, verbose=verbose, device=self.device )
-        self.res = results[0]
+        Args:
+            res: DetectionResult или ultralytics Results
+        '''
+        if not isinstance(res, DetectionResult):
+            res = DetectionResult.from_yolo(res)
+        self.res = res
+        self._labeled_image = None
 
-        if self.res.boxes is None or len(self.res.boxes) == 0:
+        if len(self.res) == 0:
             logger.info("Объекты не найдены")
             self.objects_info = []
             return None
@@ -98,68 +367,73 @@ class ObjectDetector:
 
     def _process_results(self):
         '''
-        Обрабатывает результаты инференса: боксы, маски, классы.
+        Обрабатывает результаты инференса: боксы, классы.
+        Разметка (маски, рамки, подписи) рисуется лениво при первом
+        обращении к labeled_image, так как нужна не каждому запросу.
         '''
-        classes = self.res.boxes.cls.cpu().numpy().astype(int)
+        classes = self.res.classes
         class_names = self.res.names
-        boxes = self.res.boxes.xyxy.cpu().numpy().astype(int)
-        masks = self.res.masks.data.cpu().numpy() if self.res.masks is not None else []
+        boxes = self.res.boxes.astype(int)
 
-        labeled_image = self.image.copy()
         objects_info = []
-        colors = [tuple(np.random.randint(0, 256, 3).tolist()) for _ in range(len(boxes))]
-
         for i, box in enumerate(boxes):
-            x1, y1, x2, y2 = box
             class_id = int(classes[i])
             class_name = class_names[class_id]
-            color = colors[i]
-
-            # Наложение маски
-            if len(masks) > 0:
-                mask = masks[i]
-                mask_resized = cv2.resize(mask, (self.image.shape[1], self.image.shape[0]),
-                                          interpolation=cv2.INTER_NEAREST)
-
-                mask_contours, _ = cv2.findContours(mask_resized.astype(np.uint8),
-                                                    cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-                overlay = labeled_image.copy()
-                cv2.drawContours(overlay, mask_contours, -1, color, thickness=-1)
-                alpha = 0.4
-                labeled_image = cv2.addWeighted(overlay, alpha, labeled_image, 1 - alpha, 0)
-
-                cv2.drawContours(labeled_image, mask_contours, -1, color, 2)
-
-            # Bounding box
-            cv2.rectangle(labeled_image, (x1, y1), (x2, y2), color, 2)
-
-            # Подпись
-            label = f"id={i}, {class_name}"
-            cv2.putText(labeled_image, label, (x1, y1 - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2, cv2.LINE_AA)
 
             # Сохраняем инфу
             objects_info.append({
                 "id": i,
                 "class_id": class_id,
                 "class_name": class_name,
-                "bbox": box.tolist()
+                "bbox": box.tolist(),
             })
 
-        self.labeled_image = labeled_image
         self.objects_info = objects_info
 
-    def get_objects_with_crops(self, image_format: str = 'jpg', quality: int = 95) -> List[Dict[str, Any]]:
+    @property
+    def labeled_image(self) -> np.ndarray | None:
+        '''
+        Изображение с разметкой. Рисуется при первом обращении.
+        '''
+        if self._labeled_image is None:
+            if not self.objects_info:
+                return None
+            self._labeled_image = self._render_results()
+        return self._labeled_image
+
+    def _render_results(self) -> np.ndarray:
+        '''
+        Рисует маски, рамки и подписи найденных объектов.
         '''
-        Возвращает список найденных объектов с обрезанными изображениями в формате bytes.
+        boxes = self.res.boxes.astype(int)
+        masks = self.res.masks if self.res.masks is not None else []
+
+        contours = []
+        labels = []
+        colors = [tuple(np.random.randint(0, 256, 3).tolist()) for _ in range(len(boxes))]
+        for obj, box in zip(self.objects_info, boxes):
+            # Контуры маски
+            if len(masks) > 0:
+                contours.append(mask_roi_contours(masks[obj["id"]], box, self.image.shape))
+            labels.append(f"id={obj['id']}, {obj['class_name']}")
+
+        return render_annotations(self.image, boxes, labels, colors,
+                                  contours or None)
+
+    def get_objects_with_crops(self, image_format: str = 'jpg', quality: int = 95,
+                               encode: bool = True) -> List[Dict[str, Any]]:
+        '''
+        Возвращает список найденных объектов с обрезанными изображениями.
 
         Args:
             image_format: формат изображения ('jpg', 'png')
             quality: качество для JPEG (0-100)
+            encode: кодировать ли кропы в bytes. Если False, объекты содержат
+                только img_crop - BGR срез (view) исходного изображения без
+                копирования и кодирования
 
         Returns:
-            List[Dict]: список объектов с id, img_crop_bytes и class_id
+            List[Dict]: список объектов с id, img_crop, img_crop_bytes и class_id
         '''
         if not hasattr(self, "objects_info") or not self.objects_info:
             logger.error("Нет результатов детекции. Сначала вызовите predict("
@@ -184,29 +458,23 @@ class ObjectDetector:
                 logger.warning(f"Пустая область для объекта {obj['id']}")
                 continue
 
-            # Кодируем обрезанное изображение в bytes
-            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality] if image_format.lower() == 'jpg' else []
-
-            if image_format.lower() in ['jpg', 'jpeg']:
-                success, encoded_image = cv2.imencode('.jpg', crop, encode_param)
-            elif image_format.lower() == 'png':
-                success, encoded_image = cv2.imencode('.png', crop)
-            else:
-                logger.error(f"Неподдерживаемый формат: {image_format}")
-                success = False
-
-            if success:
-                img_bytes = encoded_image.tobytes()
-
-                objects_with_crops.append({
-                    "id": obj["id"],
-                    "img_crop_bytes": img_bytes,
-                    "class_id": obj["class_id"],
-                    "class_name": obj.get("class_name", ""),
-                    "bbox": obj["bbox"]
-                })
-            else:
-                logger.error(f"Ошибка кодирования изображения для объекта {obj['id']}")
+            object_with_crop = {
+                "id": obj["id"],
+                "img_crop": crop,
+                "class_id": obj["class_id"],
+                "class_name": obj.get("class_name", ""),
+                "bbox": obj["bbox"],
+            }
+
+            if encode:
+                # Кодируем обрезанное изображение в bytes
+                img_bytes = encode_image(crop, image_format, quality)
+                if img_bytes is None:
+                    logger.error(f"Ошибка кодирования изображения для объекта {obj['id']}")
+                    continue
+                object_with_crop["img_crop_bytes"] = img_bytes
+
+            objects_with_crops.append(object_with_crop)
 
         return objects_with_crops
 
@@ -214,7 +482,7 @@ class ObjectDetector:
         '''
         Отображает изображение с разметкой.
         '''
-        if not hasattr(self, "labeled_image"):
+        if self.labeled_image is None:
             logger.error("Нет результата для отображения. Сначала вызови "
                      "predict().")
             return
@@ -243,7 +511,7 @@ class ObjectDetector:
         Returns:
             bytes: размеченное изображение в формате JPEG
         """
-        if not hasattr(self, "labeled_image"):
+        if self.labeled_image is None:
             logger.error("Нет результата для кодирования. Сначала вызовите "
                      "predict().")
             return b''
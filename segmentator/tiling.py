@@ -0,0 +1,269 @@
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+from segmentator.segmentator_inferense import DetectionResult
+
+
+def make_tiles(image_shape: tuple, tile_size: int = 1024, overlap: float = 0.2,
+               max_tiles: int = 16) -> List[Tuple[int, int, int, int]]:
+    '''
+    Разбивает изображение на перекрывающиеся тайлы.
+
+    Тайлы равномерно покрывают изображение, последний тайл в ряду
+    прижимается к краю. Если тайлов получается больше max_tiles, размер
+    тайла увеличивается.
+
+    Args:
+        image_shape: размер изображения (H, W, ...)
+        tile_size: сторона тайла в пикселях
+        overlap: доля перекрытия соседних тайлов (0..1)
+        max_tiles: максимальное количество тайлов
+
+    Returns:
+        List[Tuple]: координаты тайлов (x1, y1, x2, y2)
+    '''
+    height, width = image_shape[:2]
+
+    def axis_starts(length: int, size: int) -> List[int]:
+        if length <= size:
+            return [0]
+        step = max(1, int(size * (1 - overlap)))
+        count = math.ceil((length - size) / step) + 1
+        return [round(i * (length - size) / (count - 1)) for i in range(count)]
+
+    while True:
+        xs = axis_starts(width, tile_size)
+        ys = axis_starts(height, tile_size)
+        if len(xs) * len(ys) <= max_tiles:
+            break
+        tile_size = int(tile_size * 1.25)
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in ys
+        for x in xs
+    ]
+
+
+# Стороны bbox, обрезанные внутренней границей тайла (битовые флаги)
+CUT_LEFT, CUT_TOP, CUT_RIGHT, CUT_BOTTOM = 1, 2, 4, 8
+
+
+def box_cuts(box: np.ndarray, region: Tuple[int, int, int, int],
+             image_shape: tuple, margin: float = 2.0) -> int:
+    '''
+    Флаги сторон bbox (в координатах тайла), которые упираются во
+    внутреннюю границу тайла, т.е. объект, вероятно, разрезан швом.
+    Края изображения швом не считаются.
+    '''
+    height, width = image_shape[:2]
+    x1, y1, x2, y2 = region
+    cuts = 0
+    if x1 > 0 and box[0] <= margin:
+        cuts |= CUT_LEFT
+    if y1 > 0 and box[1] <= margin:
+        cuts |= CUT_TOP
+    if x2 < width and box[2] >= x2 - x1 - margin:
+        cuts |= CUT_RIGHT
+    if y2 < height and box[3] >= y2 - y1 - margin:
+        cuts |= CUT_BOTTOM
+    return cuts
+
+
+def _seam_parts(a: np.ndarray, cut_a: int, b: np.ndarray, cut_b: int,
+                ios_threshold: float) -> bool:
+    '''
+    Являются ли a и b частями одного объекта по разные стороны шва:
+    боксы пересекаются, обрезаны с противоположных сторон, а их проекции
+    на ось шва перекрываются больше ios_threshold от меньшей.
+    '''
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w < 0 or inter_h < 0:
+        return False
+    if (cut_a & CUT_RIGHT and cut_b & CUT_LEFT) or (cut_a & CUT_LEFT and cut_b & CUT_RIGHT):
+        min_h = max(min(a[3] - a[1], b[3] - b[1]), 1e-6)
+        if inter_h / min_h > ios_threshold:
+            return True
+    if (cut_a & CUT_BOTTOM and cut_b & CUT_TOP) or (cut_a & CUT_TOP and cut_b & CUT_BOTTOM):
+        min_w = max(min(a[2] - a[0], b[2] - b[0]), 1e-6)
+        if inter_w / min_w > ios_threshold:
+            return True
+    return False
+
+
+def merge_detections(boxes: np.ndarray, confidences: np.ndarray, classes: np.ndarray,
+                     cuts: np.ndarray = None, iou_threshold: float = 0.5,
+                     ios_threshold: float = 0.5) -> Tuple[np.ndarray, List[List[int]]]:
+    '''
+    Межтайловое объединение детекций (NMS + NMM с учётом класса).
+
+    Детекции обходятся по убыванию уверенности и сравниваются с уже
+    принятыми детекциями того же класса:
+    - IoU выше iou_threshold - дубликат из зоны перекрытия или целого
+      кадра, отбрасывается;
+    - если хотя бы одна из двух детекций обрезана швом (cuts, box_cuts)
+      и площадь пересечения больше ios_threshold от меньшей (IoS) -
+      часть объекта поглощается детекцией, бокс объединяется;
+    - части, обрезанные швом с противоположных сторон, с перекрытием
+      вдоль шва (_seam_parts) склеиваются в одну детекцию.
+    Маленькое растение внутри бокса крупного, не касающееся шва,
+    сохраняется: IoS применяется только к обрезанным детекциям.
+
+    Returns:
+        Tuple[np.ndarray, List[List[int]]]: объединённые боксы и для
+        каждого - индексы исходных детекций (первый задаёт уверенность и
+        класс), по убыванию уверенности
+    '''
+    boxes = boxes.astype(np.float32)
+    if cuts is None:
+        cuts = np.zeros(len(boxes), dtype=int)
+    merged: List[np.ndarray] = []
+    merged_cuts: List[int] = []
+    groups: List[List[int]] = []
+    for i in np.argsort(-confidences, kind="stable"):
+        box = boxes[i]
+        area = max(box[2] - box[0], 0) * max(box[3] - box[1], 0)
+        target = None
+        for j, kept in enumerate(merged):
+            if classes[groups[j][0]] != classes[i]:
+                continue
+            inter = (max(min(box[2], kept[2]) - max(box[0], kept[0]), 0)
+                     * max(min(box[3], kept[3]) - max(box[1], kept[1]), 0))
+            kept_area = max(kept[2] - kept[0], 0) * max(kept[3] - kept[1], 0)
+            if inter / max(area + kept_area - inter, 1e-6) > iou_threshold:
+                target = j
+                break
+            truncated = cuts[i] or merged_cuts[j]
+            if truncated and inter / max(min(area, kept_area), 1e-6) > ios_threshold:
+                target = j
+                break
+            if _seam_parts(box, cuts[i], kept, merged_cuts[j], ios_threshold):
+                target = j
+                break
+        if target is None:
+            merged.append(box.copy())
+            merged_cuts.append(int(cuts[i]))
+            groups.append([int(i)])
+            continue
+        kept = merged[target]
+        kept[:2] = np.minimum(kept[:2], box[:2])
+        kept[2:] = np.maximum(kept[2:], box[2:])
+        merged_cuts[target] |= int(cuts[i])
+        groups[target].append(int(i))
+    if not merged:
+        return np.zeros((0, 4), dtype=np.float32), groups
+    return np.stack(merged), groups
+
+
+def mask_roi(tile_mask: np.ndarray, box: np.ndarray,
+             tile_canvas: Tuple[int, int, int, int]) -> Tuple[np.ndarray, int, int]:
+    '''
+    Вырезает маску детекции тайла под её bbox на холсте масок.
+
+    Пиксели холста выбираются из маски тайла ближайшим соседом (как при
+    cv2.INTER_NEAREST_EXACT), но только внутри bbox.
+
+    Args:
+        tile_mask: маска [mh, mw], покрывающая тайл
+        box: bbox в координатах холста
+        tile_canvas: положение тайла на холсте (x1, y1, x2, y2)
+
+    Returns:
+        Tuple: (маска uint8 0/1 под bbox, x, y левого верхнего угла на холсте)
+    '''
+    cx1, cy1, cx2, cy2 = tile_canvas
+    x1 = min(max(int(np.floor(box[0])), cx1), cx2)
+    y1 = min(max(int(np.floor(box[1])), cy1), cy2)
+    x2 = min(max(int(np.ceil(box[2])), x1), cx2)
+    y2 = min(max(int(np.ceil(box[3])), y1), cy2)
+    mask_h, mask_w = tile_mask.shape[:2]
+    src_x = ((np.arange(x1, x2) - cx1 + 0.5) * mask_w / max(cx2 - cx1, 1)).astype(int)
+    src_y = ((np.arange(y1, y2) - cy1 + 0.5) * mask_h / max(cy2 - cy1, 1)).astype(int)
+    roi = tile_mask[np.ix_(np.minimum(src_y, mask_h - 1), np.minimum(src_x, mask_w - 1))]
+    return (roi > 0.5).astype(np.uint8), x1, y1
+
+
+def tile_regions(image_shape: tuple, tile_size: int = 1024, overlap: float = 0.2,
+                 max_tiles: int = 16) -> List[Tuple[int, int, int, int]]:
+    '''
+    Области тайловой детекции: целый кадр (для крупных объектов) и тайлы
+    make_tiles. Если изображение помещается в один тайл - только кадр.
+    '''
+    height, width = image_shape[:2]
+    tiles = make_tiles(image_shape, tile_size, overlap, max_tiles)
+    if len(tiles) == 1:
+        return [(0, 0, width, height)]
+    return [(0, 0, width, height)] + tiles
+
+
+def merge_tile_results(regions: List[Tuple[int, int, int, int]], results: list,
+                       image_shape: tuple, mask_long_side: int = 1024,
+                       iou_threshold: float = 0.5) -> DetectionResult:
+    '''
+    Переводит детекции областей tile_regions в глобальные координаты,
+    подавляет дубликаты и склеивает разрезанные швом объекты
+    (merge_detections).
+
+    Маска каждой детекции хранится только под её bbox (mask_roi), на общий
+    холст с длинной стороной mask_long_side (uint8) переносятся лишь
+    маски итоговых детекций - объединение масок всех их частей.
+
+    Args:
+        regions: области (x1, y1, x2, y2), для которых получены results
+        results: DetectionResult каждой области
+        image_shape: размер изображения (H, W, ...)
+
+    Returns:
+        DetectionResult: результат в той же форме, что и обычная детекция
+    '''
+    if len(regions) == 1:
+        return results[0]
+    height, width = image_shape[:2]
+    canvas_scale = min(1.0, mask_long_side / max(height, width))
+    canvas_h = max(1, round(height * canvas_scale))
+    canvas_w = max(1, round(width * canvas_scale))
+
+    boxes, confidences, classes, cuts, rois = [], [], [], [], []
+    names = results[0].names
+    for (x1, y1, x2, y2), res in zip(regions, results):
+        if len(res) == 0:
+            continue
+        region_boxes = res.boxes + np.array([x1, y1, x1, y1], dtype=np.float32)
+        boxes.append(region_boxes)
+        confidences.append(res.confidences)
+        classes.append(res.classes)
+        cuts.append([box_cuts(box, (x1, y1, x2, y2), image_shape) for box in res.boxes])
+        if res.masks is None:
+            continue
+        # Положение тайла на холсте масок
+        tile_canvas = (round(x1 * canvas_scale), round(y1 * canvas_scale),
+                       round(x2 * canvas_scale), round(y2 * canvas_scale))
+        for tile_mask, box in zip(res.masks, region_boxes):
+            rois.append(mask_roi(tile_mask, box * canvas_scale, tile_canvas))
+
+    if not boxes:
+        return DetectionResult(np.zeros((0, 4), dtype=np.float32),
+                               np.zeros(0, dtype=np.float32),
+                               np.zeros(0, dtype=int), names, (height, width))
+
+    boxes = np.concatenate(boxes)
+    confidences = np.concatenate(confidences)
+    classes = np.concatenate(classes)
+    cuts = np.concatenate(cuts).astype(int)
+    merged, groups = merge_detections(boxes, confidences, classes, cuts,
+                                      iou_threshold=iou_threshold)
+    first = np.array([group[0] for group in groups], dtype=int)
+
+    masks = None
+    if len(rois) == len(boxes):
+        masks = np.zeros((len(groups), canvas_h, canvas_w), dtype=np.uint8)
+        for mask, group in zip(masks, groups):
+            for i in group:
+                roi, x, y = rois[i]
+                window = mask[y:y + roi.shape[0], x:x + roi.shape[1]]
+                np.maximum(window, roi, out=window)
+    return DetectionResult(merged, confidences[first], classes[first], names,
+                           (height, width), masks)
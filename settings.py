@@ -33,3 +33,99 @@ MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 INF_MODEL_PATH = os.getenv("INF_MODEL_PATH", "../models/best.pt")
 INF_IOU = os.getenv("INF_IOU", 0.6)
 INF_CONF = os.getenv("INF_CONF", 0.6)
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "mobileclip_s1")
+CLIP_WEIGHTS_PATH = os.getenv(
+    "CLIP_WEIGHTS_PATH", "models/mobileclip_s1_finetuned.pt"
+)
+# Директория для кэша эмбеддингов промптов
+CLIP_CACHE_DIR = os.getenv("CLIP_CACHE_DIR", "models/cache")
+
+# Микро-батчинг энкодера изображений CLIP между запросами
+CLIP_BATCH_MAX_SIZE = int(os.getenv("CLIP_BATCH_MAX_SIZE", 16))
+CLIP_BATCH_MAX_WAIT_MS = float(os.getenv("CLIP_BATCH_MAX_WAIT_MS", 8))
+
+# Батчинг детектора YOLO между запросами
+DETECTOR_BATCH_MAX_SIZE = int(os.getenv("DETECTOR_BATCH_MAX_SIZE", 8))
+DETECTOR_BATCH_MAX_WAIT_MS = float(os.getenv("DETECTOR_BATCH_MAX_WAIT_MS", 20))
+
+# Исполнитель CPU-bound этапов инференса: thread, process или fork
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", min(4, os.cpu_count() or 1)))
+# Потоков torch на один процесс-воркер (режимы process и fork)
+INFERENCE_WORKER_THREADS = int(os.getenv(
+    "INFERENCE_WORKER_THREADS", max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS)
+))
+
+# Длинная сторона, до которой допускается уменьшение фото при декодировании
+# (0 - декодировать в исходном размере). Фото с рамками и кропы загружаются
+# в уменьшенном разрешении
+DECODE_TARGET_LONG_SIDE = int(os.getenv("DECODE_TARGET_LONG_SIDE", 2048))
+
+# Тайловая детекция для фото высокого разрешения (перекрывающиеся тайлы)
+DETECTOR_TILING = os.getenv("DETECTOR_TILING", "false").lower() in ("1", "true", "yes")
+DETECTOR_TILE_SIZE = int(os.getenv("DETECTOR_TILE_SIZE", 1024))
+DETECTOR_TILE_OVERLAP = float(os.getenv("DETECTOR_TILE_OVERLAP", 0.2))
+DETECTOR_MAX_TILES = int(os.getenv("DETECTOR_MAX_TILES", 16))
+# Порог IoU подавления дубликатов между тайлами
+DETECTOR_TILE_NMS_IOU = float(os.getenv("DETECTOR_TILE_NMS_IOU", 0.5))
+
+# Пороги детектора YOLO (уверенность, IoU NMS) и размер входа
+DETECTOR_CONF = float(os.getenv("DETECTOR_CONF", 0.2))
+DETECTOR_IOU = float(os.getenv("DETECTOR_IOU", 0.65))
+DETECTOR_IMGSZ = int(os.getenv("DETECTOR_IMGSZ", 640))
+# Порог уверенности дефекта в классификаторе CLIP
+CLIP_DEFECT_THRESHOLD = float(os.getenv("CLIP_DEFECT_THRESHOLD", 0.1))
+
+# Отрисовка фото с рамками: sync - до ответа, background - после ответа
+# (framed_url известен сразу, файл появляется в S3 позже)
+ANNOTATION_MODE = os.getenv("ANNOTATION_MODE", "sync")
+
+# Потоков для JPEG кодирования кропов и фото с рамками (потоки torch
+# уменьшаются, чтобы вместе не превышать число ядер)
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", max(1, min(4, (os.cpu_count() or 1) // 2))))
+
+# Долгоживущий клиент S3: размер пула соединений, попытки и keep-alive, сек.
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 32))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 3))
+S3_KEEPALIVE_TIMEOUT = float(os.getenv("S3_KEEPALIVE_TIMEOUT", 60))
+# Одновременных загрузок в S3 на процесс
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", 16))
+
+# Загрузка файлов скана: sync - до ответа, queue - отложенно через очередь
+# загрузок (URL по детерминированным ключам отдаются сразу)
+UPLOAD_MODE = os.getenv("UPLOAD_MODE", "sync")
+# Хранилище очереди загрузок: s3, local (директория UPLOAD_LOCAL_DIR) или memory
+UPLOAD_STORAGE = os.getenv("UPLOAD_STORAGE", "s3")
+UPLOAD_LOCAL_DIR = os.getenv("UPLOAD_LOCAL_DIR", "uploads")
+UPLOAD_QUEUE_WORKERS = int(os.getenv("UPLOAD_QUEUE_WORKERS", 8))
+# Бюджет памяти очереди загрузок, МБ
+UPLOAD_QUEUE_MAX_MB = int(os.getenv("UPLOAD_QUEUE_MAX_MB", 256))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", 5))
+UPLOAD_RETRY_BASE_MS = float(os.getenv("UPLOAD_RETRY_BASE_MS", 200))
+
+# Кэш результатов скана по хэшу фото: записей в памяти (0 - выключен), TTL, сек.,
+# директория дискового уровня (пусто - без диска) и его размер, МБ
+RESULT_CACHE_MAX_ITEMS = int(os.getenv("RESULT_CACHE_MAX_ITEMS", 1024))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 86400))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_MB = int(os.getenv("RESULT_CACHE_DISK_MB", 512))
+
+# Кэш эмбеддингов кропов CLIP: записей (0 - выключен), бюджет памяти, МБ,
+# и допуск перцептивного хэша в битах (0 - точное совпадение пикселей)
+CROP_CACHE_MAX_ITEMS = int(os.getenv("CROP_CACHE_MAX_ITEMS", 20000))
+CROP_CACHE_MAX_MB = int(os.getenv("CROP_CACHE_MAX_MB", 64))
+CROP_CACHE_TOLERANCE = int(os.getenv("CROP_CACHE_TOLERANCE", 0))
+
+# Снимки кэшей (эмбеддинги кропов, результаты) для тёплого старта: директория
+# (пусто - выключены) и период сохранения, сек. (0 - только при остановке)
+CACHE_SNAPSHOT_DIR = os.getenv("CACHE_SNAPSHOT_DIR", "models/cache/snapshots")
+CACHE_SNAPSHOT_INTERVAL = float(os.getenv("CACHE_SNAPSHOT_INTERVAL", 600))
+
+# Асинхронные задачи скана (/scan/jobs): воркеров, максимум задач в очереди,
+# бюджет памяти на фото в очереди, максимум хранимых задач и время хранения
+# результата, сек.
+SCAN_JOB_WORKERS = int(os.getenv("SCAN_JOB_WORKERS", 4))
+SCAN_JOB_MAX_PENDING = int(os.getenv("SCAN_JOB_MAX_PENDING", 64))
+SCAN_JOB_MAX_PENDING_MB = int(os.getenv("SCAN_JOB_MAX_PENDING_MB", 256))
+SCAN_JOB_MAX_STORED = int(os.getenv("SCAN_JOB_MAX_STORED", 10000))
+SCAN_JOB_RESULT_TTL = float(os.getenv("SCAN_JOB_RESULT_TTL", 3600))
@@ -0,0 +1,76 @@
+import asyncio
+
+from utils.batch_util import MicroBatcher
+
+
+def test_batcher_coalesces_concurrent_requests():
+    batches = []
+
+    def process_batch(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher("test", process_batch, max_batch_size=4, max_wait_ms=50)
+
+    async def run():
+        results = await asyncio.gather(
+            batcher.submit_many([1, 2]),
+            batcher.submit_many([3]),
+            batcher.submit(4),
+            batcher.submit(5),
+        )
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert results == [[2, 4], [6], 8, 10]
+    assert [len(batch) for batch in batches] == [4, 1]
+    assert batcher.batch_sizes.count == 2
+
+
+def test_batcher_propagates_errors():
+    def process_batch(items):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher("test_error", process_batch, max_wait_ms=1)
+
+    async def run():
+        try:
+            await batcher.submit(1)
+        except ValueError as e:
+            return str(e)
+        finally:
+            await batcher.stop()
+
+    assert asyncio.run(run()) == "boom"
+
+
+def test_batcher_runs_batches_concurrently():
+    active, peak = [0], [0]
+
+    async def slow_batch(items):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.05)
+        active[0] -= 1
+        return items
+
+    class AsyncExecutor:
+        model_concurrency = 2
+
+        async def run(self, func, items):
+            return await func(items)
+
+    batcher = MicroBatcher(
+        "test_concurrent", slow_batch, max_batch_size=1, max_wait_ms=1,
+        executor=AsyncExecutor(),
+    )
+
+    async def run():
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(4)))
+        await batcher.stop()
+        return results
+
+    assert asyncio.run(run()) == [0, 1, 2, 3]
+    assert batcher.max_concurrency == 2
+    assert peak[0] == 2
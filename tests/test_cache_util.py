@@ -0,0 +1,174 @@
+import asyncio
+import mmap
+
+from schemas.schemas import Plant, PredictSchema
+from utils import cache_util
+from utils.cache_util import ResultCache, content_hash
+
+
+def make_predict(name: str = "Клён", crop_url: str = "https://s3/req/object_0_tree.jpg"):
+    return PredictSchema(
+        plants=[Plant(id=1, name=name, type="tree", crop_url=crop_url)],
+        framed_url="https://s3/req/req_annotated.jpg",
+    )
+
+
+def test_memory_lru_evicts_oldest(monkeypatch):
+    monkeypatch.setattr(cache_util, "models_version", lambda: "v1")
+    cache = ResultCache(max_items=2)
+
+    async def run():
+        keys = [cache.make_key(content_hash(bytes([i]))) for i in range(3)]
+        for key in keys:
+            await cache.set(key, make_predict())
+        return [await cache.get(key) for key in keys]
+
+    first, second, third = asyncio.run(run())
+    assert first is None
+    assert second is not None and third is not None
+
+
+def test_ttl_and_upload_errors(monkeypatch):
+    monkeypatch.setattr(cache_util, "models_version", lambda: "v1")
+    cache = ResultCache(max_items=10, ttl=-1)
+    failed = ResultCache(max_items=10)
+
+    async def run():
+        await cache.set("expired", make_predict())
+        await failed.set("failed", make_predict(crop_url="Изображение не было загружено"))
+        return await cache.get("expired"), await failed.get("failed")
+
+    assert asyncio.run(run()) == (None, None)
+
+
+def test_disk_tier_survives_new_instance(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_util, "models_version", lambda: "v1")
+
+    async def run():
+        cache = ResultCache(max_items=10, disk_dir=str(tmp_path))
+        key = cache.make_key("hash", framed=True)
+        await cache.set(key, make_predict("Липа"))
+        cache.close()
+        restored = ResultCache(max_items=10, disk_dir=str(tmp_path))
+        try:
+            _, expires_at = restored.disk.get(key, expire_time=True)
+            return await restored.get(key), restored._items[key][0], expires_at
+        finally:
+            restored.close()
+
+    predict, memory_expires_at, disk_expires_at = asyncio.run(run())
+    assert predict.plants[0].name == "Липа"
+    # Перенос с диска в память не продлевает TTL
+    assert memory_expires_at == disk_expires_at
+
+
+def test_version_change_invalidates(monkeypatch):
+    version = ["v1"]
+    monkeypatch.setattr(cache_util, "models_version", lambda: version[0])
+    cache = ResultCache(max_items=10)
+
+    async def run():
+        key = cache.make_key("hash")
+        await cache.set(key, make_predict())
+        version[0] = "v2"
+        assert cache.refresh_version()
+        return await cache.get(key), cache.make_key("hash")
+
+    cached, new_key = asyncio.run(run())
+    assert cached is None
+    assert new_key.startswith("v2:")
+
+
+def test_single_flight_runs_identical_calls_once():
+    from utils.cache_util import SingleFlight
+
+    flights = SingleFlight("test_flight")
+    calls = []
+
+    async def scan():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return make_predict()
+
+    async def run():
+        results = await asyncio.gather(*(flights.do("same", scan) for _ in range(5)))
+        results.append(await flights.do("same", scan))
+        return results
+
+    results = asyncio.run(run())
+    assert len(calls) == 2
+    assert all(result is results[0] for result in results[:5])
+
+
+def test_single_flight_shares_errors():
+    from utils.cache_util import SingleFlight
+
+    flights = SingleFlight("test_flight_errors")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("битое фото")
+
+    async def run():
+        return await asyncio.gather(
+            flights.do("bad", fail), flights.do("bad", fail), return_exceptions=True
+        )
+
+    errors = asyncio.run(run())
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_snapshot_restore_roundtrip(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_util, "models_version", lambda: "v1")
+    cache = ResultCache(max_items=10)
+    key = cache.make_key(content_hash(b"photo"))
+    asyncio.run(cache.set(key, make_predict()))
+    assert cache.snapshot(tmp_path) == 1
+
+    restored = ResultCache(max_items=10)
+    assert restored.restore(tmp_path) == 1
+    assert not restored._items
+    assert isinstance(restored._snapshot_data, mmap.mmap)
+    assert asyncio.run(restored.get(key)) == make_predict()
+
+    monkeypatch.setattr(cache_util, "models_version", lambda: "v2")
+    assert ResultCache(max_items=10).restore(tmp_path) == 0
+
+
+def test_failed_upload_evicts_request_results(monkeypatch):
+    monkeypatch.setattr(cache_util, "models_version", lambda: "v1")
+    cache = ResultCache(max_items=10)
+
+    async def run():
+        key = cache.make_key(content_hash(b"photo"))
+        await cache.set(key, make_predict(), request_id="req")
+        cached = await cache.get(key)
+        cache.evict_object("req/req_annotated.jpg")
+        evicted = await cache.get(key)
+        # Результат, досчитанный после неудачной загрузки, не кэшируется
+        await cache.set(key, make_predict(), request_id="req")
+        return cached, evicted, await cache.get(key)
+
+    cached, evicted, late = asyncio.run(run())
+    assert cached is not None
+    assert evicted is None and late is None
+
+
+def test_failed_upload_evicts_disk_results_in_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_util, "models_version", lambda: "v1")
+    cache = ResultCache(max_items=10, disk_dir=str(tmp_path))
+
+    async def run():
+        key = cache.make_key(content_hash(b"photo"))
+        await cache.set(key, make_predict(), request_id="req")
+        cache.evict_object("req/req_annotated.jpg")
+        evicted = await cache.get(key)
+        await asyncio.gather(*cache._tasks)
+        return key, evicted
+
+    try:
+        key, evicted = asyncio.run(run())
+        assert evicted is None
+        assert cache.disk.get(key) is None and not cache._deleting
+    finally:
+        cache.close()
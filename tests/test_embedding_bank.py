@@ -0,0 +1,37 @@
+import numpy as np
+import torch
+
+from clip.embedding_bank import TextEmbeddingBank
+
+
+def test_bank_is_built_once_and_rebuilt_on_prompt_change(tmp_path):
+    calls = []
+
+    def encode_texts(texts):
+        calls.append(list(texts))
+        return np.random.rand(len(texts), 8).astype(np.float32)
+
+    prompt_sets = {"species": ["oak", "pine"], "defects": ["dead branches"]}
+    bank = TextEmbeddingBank.load_or_build(
+        encode_texts, prompt_sets, "checkpoint", str(tmp_path), "mobileclip_s1"
+    )
+    assert bank.embeddings.shape == (3, 8)
+    assert np.allclose(np.linalg.norm(bank.embeddings, axis=-1), 1.0)
+    assert bank.get("defects").shape == (1, 8)
+
+    cached = TextEmbeddingBank.load_or_build(
+        encode_texts, prompt_sets, "checkpoint", str(tmp_path), "mobileclip_s1"
+    )
+    assert len(calls) == 1
+    assert isinstance(cached.embeddings, np.memmap)
+    assert np.allclose(cached.embeddings, bank.embeddings)
+    # Тензор разделяет память с memory map, без копии банка
+    tensor = torch.from_numpy(cached.embeddings)
+    assert tensor.data_ptr() == cached.embeddings.ctypes.data
+
+    prompt_sets["species"].append("birch")
+    TextEmbeddingBank.load_or_build(
+        encode_texts, prompt_sets, "checkpoint", str(tmp_path), "mobileclip_s1"
+    )
+    assert len(calls) == 2
+    assert len(list(tmp_path.glob("text_bank_*.npy"))) == 1
@@ -0,0 +1,91 @@
+import numpy as np
+
+from clip.embedding_cache import CropEmbeddingCache, exact_hash, perceptual_hash
+
+
+def random_crop(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+
+
+def unit(dim: int, seed: int) -> np.ndarray:
+    vector = np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_cache_returns_float16_rounded_embeddings():
+    cache = CropEmbeddingCache(max_items=10)
+    crop = random_crop(0)
+    key = cache.key(crop)
+    embedding = unit(512, 0)
+
+    assert cache.get_many([key]) == [None]
+    cache.put_many([key], [embedding])
+    (cached,) = cache.get_many([cache.key(crop.copy())])
+
+    assert cached.dtype == np.float32
+    np.testing.assert_allclose(cached, embedding, atol=1e-3)
+    assert cache._embeddings.dtype == np.float16
+
+
+def test_cache_evicts_least_recently_used():
+    cache = CropEmbeddingCache(max_items=2)
+    keys = [exact_hash(random_crop(i)) for i in range(3)]
+    cache.put_many(keys[:2], [unit(8, 0), unit(8, 1)])
+    cache.get_many([keys[0]])
+    cache.put_many([keys[2]], [unit(8, 2)])
+
+    hits = [features is not None for features in cache.get_many(keys)]
+    assert hits == [True, False, True]
+
+
+def test_memory_cap_limits_capacity():
+    cache = CropEmbeddingCache(max_items=1000, max_bytes=512 * 2 * 10)
+    cache.put_many([1], [unit(512, 0)])
+    assert cache.capacity == 10
+
+
+def test_perceptual_tolerance_matches_near_duplicates():
+    cache = CropEmbeddingCache(max_items=10, tolerance=4)
+    crop = np.tile(np.linspace(0, 255, 64, dtype=np.uint8), (64, 1))
+    crop = np.dstack([crop] * 3)
+    noisy = np.clip(crop.astype(int) + np.random.default_rng(1).integers(-2, 3, crop.shape),
+                    0, 255).astype(np.uint8)
+
+    cache.put_many([cache.key(crop)], [unit(8, 0)])
+    assert cache.get_many([cache.key(noisy)])[0] is not None
+    assert cache.get_many([perceptual_hash(crop[::-1, ::-1])])[0] is None
+
+
+def test_snapshot_restores_lazily_for_same_version(tmp_path):
+    cache = CropEmbeddingCache(max_items=10)
+    keys = [exact_hash(random_crop(i)) for i in range(3)]
+    cache.put_many(keys, [unit(8, i) for i in range(3)])
+    assert cache.snapshot(tmp_path, "v1") == 3
+
+    stale = CropEmbeddingCache(max_items=10)
+    assert stale.restore(tmp_path, "v2") == 0
+
+    restored = CropEmbeddingCache(max_items=10)
+    assert restored.restore(tmp_path, "v1") == 3
+    assert not restored._slots
+    (cached,) = restored.get_many([keys[1]])
+    np.testing.assert_allclose(cached, unit(8, 1), atol=1e-3)
+    assert list(restored._slots) == [keys[1]]
+
+    # Непрочитанные записи снимка попадают и в следующий снимок
+    assert restored.snapshot(tmp_path, "v1") == 3
+
+
+def test_snapshot_generations_are_not_mixed(tmp_path):
+    cache = CropEmbeddingCache(max_items=10)
+    cache.put_many([1, 2], [unit(8, 1), unit(8, 2)])
+    cache.snapshot(tmp_path, "v1")
+    cache.put_many([3], [unit(8, 3)])
+    cache.snapshot(tmp_path, "v1")
+    # Файлы прерванного снимка без переключения crop_cache.json
+    np.save(tmp_path / "crop_cache_hashes.crashed.npy", np.array([7], dtype=np.uint64))
+
+    assert len(list(tmp_path.glob("crop_cache_embeddings.*.npy"))) == 1
+    restored = CropEmbeddingCache(max_items=10)
+    assert restored.restore(tmp_path, "v1") == 3
+    np.testing.assert_allclose(restored.get_many([3])[0], unit(8, 3), atol=1e-3)
@@ -0,0 +1,23 @@
+import asyncio
+
+import cv2
+import numpy as np
+
+from utils.encode_util import ImageEncoder
+from utils.metrics_util import metrics
+
+
+def test_encode_many_keeps_order_and_records_timings():
+    encoder = ImageEncoder(max_workers=2)
+    images = [np.full((20 + i, 30, 3), i * 40, dtype=np.uint8) for i in range(4)]
+    before = metrics.histogram("encode_crop_ms").count
+
+    try:
+        encoded = asyncio.run(encoder.encode_many(images))
+    finally:
+        encoder.shutdown()
+
+    for image, image_bytes in zip(images, encoded):
+        decoded = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        assert decoded.shape == image.shape
+    assert metrics.histogram("encode_crop_ms").count == before + 4
@@ -0,0 +1,10 @@
+from utils import executor_util
+from utils.executor_util import InferenceExecutor
+
+
+def test_worker_threads_leave_room_for_encoding(monkeypatch):
+    monkeypatch.setattr(executor_util.os, "cpu_count", lambda: 8)
+
+    assert InferenceExecutor("process", 2, 4, reserved_threads=2).worker_num_threads() == 3
+    assert InferenceExecutor("process", 2, 3, reserved_threads=2).worker_num_threads() == 3
+    assert InferenceExecutor("process", 8, 1, reserved_threads=4).worker_num_threads() == 1
@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils.image_util import check_image_header, decode_image
+
+
+def encode(image, ext):
+    success, encoded = cv2.imencode(ext, image)
+    assert success
+    return encoded.tobytes()
+
+
+@pytest.mark.parametrize("ext, image_format", [(".jpg", "jpeg"), (".png", "png")])
+def test_decode_image_keeps_array_format_and_bytes(ext, image_format):
+    image = np.zeros((120, 90, 3), dtype=np.uint8)
+    image_bytes = encode(image, ext)
+
+    decoded = decode_image(image_bytes)
+
+    assert decoded.shape == (120, 90, 3)
+    assert decoded.array.shape == decoded.shape
+    assert decoded.source_format == image_format
+    assert decoded.original_bytes is image_bytes
+
+
+def test_decode_image_rejects_invalid_bytes():
+    with pytest.raises(ValueError):
+        decode_image(b"not an image")
+
+
+def test_check_image_header_without_decoding():
+    image_bytes = encode(np.zeros((20, 30, 3), dtype=np.uint8), ".jpg")
+    assert check_image_header(image_bytes) == "jpeg"
+    for bad in (b"", b"not an image", image_bytes[:4]):
+        with pytest.raises(ValueError):
+            check_image_header(bad)
+
+
+@pytest.mark.parametrize("ext, image_format", [
+    (".webp", "webp"), (".bmp", "bmp"), (".tiff", "tiff"), (".ppm", "pnm"),
+    (".pam", "pam"), (".sr", "sunras"), (".hdr", "hdr"),
+])
+def test_header_check_accepts_what_decode_accepts(ext, image_format):
+    image_bytes = encode(np.zeros((20, 30, 3), dtype=np.uint8), ext)
+    assert check_image_header(image_bytes) == image_format
+    assert decode_image(image_bytes).source_format == image_format
+
+
+def test_decode_image_reduces_large_jpeg():
+    image = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    image_bytes = encode(image, ".jpg")
+
+    decoded = decode_image(image_bytes, target_long_side=1024)
+
+    assert decoded.shape[:2] == (1500, 2000)
+
+    full = decode_image(image_bytes, target_long_side=0)
+    assert full.shape[:2] == (3000, 4000)
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from schemas.schemas import JobStatus, PredictSchema
+from utils.job_util import JobQueueFull, ScanJobQueue
+
+
+def make_predict(url: str = "https://s3/req/req_annotated.jpg") -> PredictSchema:
+    return PredictSchema(plants=[], framed_url=url)
+
+
+def test_jobs_complete_and_report_errors():
+    async def handler(payload):
+        await asyncio.sleep(0.01)
+        if payload == "bad":
+            raise RuntimeError("сломалось")
+        return make_predict(payload)
+
+    async def run():
+        jobs = ScanJobQueue(workers=2, max_pending=10)
+        await jobs.start(handler)
+        good = jobs.submit("https://s3/a.jpg")
+        bad = jobs.submit("bad")
+        assert good.status == JobStatus.queued
+        await jobs.stop()
+        return jobs.get(good.id), jobs.get(bad.id)
+
+    good, bad = asyncio.run(run())
+    assert good.status == JobStatus.done
+    assert good.result.id == good.id
+    assert good.result.predict.framed_url == "https://s3/a.jpg"
+    assert bad.status == JobStatus.failed and bad.error == "сломалось"
+
+
+def test_queue_rejects_when_full():
+    release = None
+
+    async def handler(payload):
+        await release.wait()
+        return make_predict()
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        jobs = ScanJobQueue(workers=1, max_pending=1)
+        await jobs.start(handler)
+        jobs.submit(1)
+        await asyncio.sleep(0.01)
+        jobs.submit(2)
+        with pytest.raises(JobQueueFull):
+            jobs.submit(3)
+        release.set()
+        await jobs.stop()
+
+    asyncio.run(run())
+
+
+def test_finished_jobs_expire_after_ttl():
+    async def run():
+        jobs = ScanJobQueue(workers=1, max_pending=1, result_ttl=0)
+        await jobs.start(None)
+        job = jobs.submit(result=make_predict())
+        assert job.status == JobStatus.done
+        expired = jobs.get(job.id)
+        await jobs.stop()
+        return expired
+
+    assert asyncio.run(run()) is None
+
+
+def test_stored_jobs_and_pending_bytes_are_capped():
+    release = None
+
+    async def handler(payload):
+        await release.wait()
+        return make_predict()
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        jobs = ScanJobQueue(workers=1, max_pending=10, max_pending_bytes=100, max_stored=3)
+        await jobs.start(handler)
+        jobs.submit(b"x" * 60, size=60)
+        with pytest.raises(JobQueueFull):
+            jobs.submit(b"x" * 60, size=60)
+        jobs.submit(result=make_predict())
+        jobs.submit(result=make_predict())
+        # Задачи из кэша тоже хранятся и учитываются в max_stored
+        with pytest.raises(JobQueueFull):
+            jobs.submit(result=make_predict())
+        release.set()
+        await jobs.stop()
+        return jobs.pending_bytes
+
+    assert asyncio.run(run()) == 0
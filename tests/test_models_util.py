@@ -0,0 +1,30 @@
+from utils.models_util import ModelRegistry
+
+
+def test_registry_loads_model_once():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return object()
+
+    registry = ModelRegistry()
+    registry.register("model", loader)
+    assert not registry.is_loaded("model")
+    model = registry.get("model")
+    registry.load_all()
+    assert registry.get("model") is model
+    assert len(calls) == 1
+    assert "model" in registry.load_times
+
+
+def test_registry_notifies_listeners_on_load():
+    loaded = []
+    registry = ModelRegistry()
+    registry.register("model", object)
+    registry.add_listener(loaded.append)
+    registry.get("model")
+    registry.get("model")
+    registry.clear()
+    registry.get("model")
+    assert loaded == ["model", "model"]
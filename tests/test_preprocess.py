@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from torchvision.transforms import (
+    CenterCrop,
+    Compose,
+    InterpolationMode,
+    Resize,
+    ToTensor,
+)
+
+from clip.preprocess import CropPreprocessor
+
+
+def make_crop(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    small = (rng.random((max(2, height // 16), max(2, width // 16), 3)) * 255)
+    image = cv2.resize(small.astype(np.uint8), (width, height),
+                       interpolation=cv2.INTER_CUBIC)
+    noise = rng.normal(0, 8, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize(
+    "height, width",
+    [(100, 80), (300, 200), (256, 256), (640, 480), (1200, 900), (2000, 700)],
+)
+def test_preprocessor_matches_torchvision_pipeline(height, width):
+    reference = Compose([
+        Resize(256, interpolation=InterpolationMode.BILINEAR),
+        CenterCrop(256),
+        ToTensor(),
+    ])
+    crop = make_crop(height, width)
+    expected = reference(Image.fromarray(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)))
+
+    preprocessor = CropPreprocessor(256)
+    batch = preprocessor.to_tensor(np.stack([
+        preprocessor.resize(crop), preprocessor.resize(crop[:, ::-1])
+    ]))
+
+    assert batch.shape == (2, 3, 256, 256)
+    diff = (batch[0] - expected).abs()
+    assert float(diff.mean()) < 0.01
+    assert float(diff.max()) < 0.1
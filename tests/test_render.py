@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+
+from segmentator.benchmark_render import make_scene, render_annotations_sequential
+from segmentator.segmentator_inferense import render_annotations
+
+
+def _contours(mask, offset):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+    return contours
+
+
+def test_single_pass_matches_sequential_for_separate_objects():
+    image = np.random.default_rng(0).integers(0, 256, (400, 600, 3), dtype=np.uint8)
+    mask = np.zeros((100, 120), dtype=np.uint8)
+    cv2.ellipse(mask, (60, 50), (55, 45), 0, 0, 360, 1, -1)
+    boxes = np.array([[50, 80, 170, 180], [350, 250, 470, 350]])
+    contours = [_contours(mask, (50, 80)), _contours(mask, (350, 250))]
+    labels = ["id=0, tree", "id=1, bush"]
+    colors = [(0, 0, 255), (0, 255, 0)]
+
+    expected = render_annotations_sequential(image, boxes, labels, colors, contours)
+    result = render_annotations(image, boxes, labels, colors, contours)
+
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_render_without_masks_draws_boxes_only():
+    image, boxes, labels, colors, _ = make_scene(320, 240, 3)
+    result = render_annotations(image, boxes, labels, colors)
+    assert result.shape == image.shape
+    assert not np.array_equal(result, image)
+
+
+def test_render_overlapping_objects_close_to_sequential():
+    scene = make_scene(800, 600, 30)
+    expected = render_annotations_sequential(*scene).astype(np.int16)
+    result = render_annotations(*scene).astype(np.int16)
+    # Отличия только там, где маски и рамки перекрываются
+    assert np.mean(np.abs(result - expected) > 0) < 0.1
+
+
+def test_mask_roi_contours_match_full_frame_resize():
+    from segmentator.segmentator_inferense import mask_roi_contours
+
+    image_shape = (1500, 2000, 3)
+    mask = np.zeros((120, 160), dtype=np.float32)
+    cv2.ellipse(mask, (70, 50), (30, 20), 0, 0, 360, 1.0, -1)
+    box = np.array([40 * 12.5, 30 * 12.5, 100 * 12.5, 70 * 12.5])
+
+    full = cv2.resize(mask, (image_shape[1], image_shape[0]),
+                      interpolation=cv2.INTER_NEAREST).astype(np.uint8)
+    filled = np.zeros(image_shape[:2], dtype=np.uint8)
+    cv2.drawContours(filled, mask_roi_contours(mask, box, image_shape), -1, 1, -1)
+
+    intersection = np.logical_and(full, filled).sum()
+    union = np.logical_or(full, filled).sum()
+    assert intersection / union > 0.98
+
+
+def test_mask_roi_contours_empty_box():
+    from segmentator.segmentator_inferense import mask_roi_contours
+
+    mask = np.ones((10, 10), dtype=np.float32)
+    assert len(mask_roi_contours(mask, np.array([5, 5, 5, 5]), (100, 100))) == 0
+
+
+def test_detector_renders_annotation_lazily(monkeypatch):
+    import segmentator.segmentator_inferense as inferense
+    from segmentator.segmentator_inferense import DetectionResult, ObjectDetector
+
+    calls = []
+    original = inferense.render_annotations
+    monkeypatch.setattr(inferense, "render_annotations",
+                        lambda *args, **kwargs: calls.append(1) or original(*args, **kwargs))
+
+    detector = ObjectDetector()
+    detector.image = np.zeros((200, 300, 3), dtype=np.uint8)
+    detector.set_results(DetectionResult(
+        boxes=np.array([[10, 20, 110, 120]], dtype=np.float32),
+        confidences=np.array([0.9], dtype=np.float32),
+        classes=np.array([0]),
+        names={0: "tree"},
+        orig_shape=(200, 300),
+    ))
+
+    assert detector.get_objects_with_crops(encode=False)
+    assert calls == []
+    assert detector.get_annotated_image_bytes()
+    assert detector.labeled_image is not None
+    assert calls == [1]
@@ -0,0 +1,55 @@
+import asyncio
+
+from utils.s3_util import S3ClientManager, public_url
+
+
+def test_manager_reuses_one_client():
+    manager = S3ClientManager()
+
+    async def run():
+        first = await manager.get()
+        second = await manager.get()
+        await manager.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+
+
+def test_public_url_matches_key_layout():
+    assert public_url("req", "object_1_tree.jpg").endswith("/req/object_1_tree.jpg")
+
+
+def test_upload_files_is_bounded_and_keeps_partial_failures(monkeypatch):
+    from botocore.exceptions import ClientError
+
+    from utils import s3_util
+
+    manager = S3ClientManager()
+    monkeypatch.setattr(s3_util, "s3_manager", manager)
+    monkeypatch.setattr(s3_util, "S3_UPLOAD_CONCURRENCY", 2)
+    active = []
+    peak = []
+
+    async def put_object(Bucket, Key, Body):
+        active.append(Key)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(Key)
+        if Key.endswith("object_3.jpg"):
+            raise ClientError({"Error": {"Code": "500"}}, "PutObject")
+
+    async def run():
+        client = await manager.get()
+        monkeypatch.setattr(client, "put_object", put_object)
+        files = {i: (f"object_{i}.jpg", b"data") for i in range(6)}
+        try:
+            return await s3_util.upload_files(files, "req")
+        finally:
+            await manager.close()
+
+    urls = asyncio.run(run())
+    assert max(peak) == 2
+    assert sorted(urls) == list(range(6))
+    assert urls[3] == "Изображение не было загружено (ошибка S3)"
+    assert urls[0].endswith("/req/object_0.jpg")
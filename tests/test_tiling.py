@@ -0,0 +1,118 @@
+import numpy as np
+
+from segmentator.segmentator_inferense import DetectionResult
+from segmentator.tiling import (CUT_LEFT, CUT_RIGHT, box_cuts, make_tiles, merge_detections,
+                                merge_tile_results, tile_regions)
+
+
+def test_tiles_cover_image_with_overlap():
+    tiles = make_tiles((3000, 4000, 3), tile_size=1024, overlap=0.2, max_tiles=20)
+
+    covered = np.zeros((3000, 4000), dtype=bool)
+    for x1, y1, x2, y2 in tiles:
+        assert x2 - x1 <= 1024 and y2 - y1 <= 1024
+        covered[y1:y2, x1:x2] = True
+    assert covered.all()
+    assert len(tiles) == 20
+
+
+def test_tile_size_grows_to_fit_max_tiles():
+    tiles = make_tiles((4000, 6000, 3), tile_size=512, overlap=0.2, max_tiles=4)
+    assert len(tiles) <= 4
+    assert tiles[-1][2:] == (6000, 4000)
+
+
+def test_merge_joins_tree_split_at_seam():
+    boxes = np.array([
+        [100, 100, 1024, 400],   # левая часть дерева, упирается в правый край тайла
+        [819, 120, 1300, 380],   # правая часть, упирается в левый край соседнего тайла
+        [825, 110, 1290, 390],   # дубликат правой части
+        [2000, 2000, 2100, 2100],
+    ], dtype=np.float32)
+    confidences = np.array([0.9, 0.8, 0.6, 0.7], dtype=np.float32)
+    classes = np.array([0, 0, 0, 0])
+    cuts = np.array([CUT_RIGHT, CUT_LEFT, CUT_LEFT, 0])
+
+    merged, groups = merge_detections(boxes, confidences, classes, cuts)
+
+    assert groups == [[0, 1, 2], [3]]
+    assert merged[0].tolist() == [100, 100, 1300, 400]
+
+
+def test_merge_absorbs_seam_part_into_full_frame_box():
+    boxes = np.array([[100, 100, 1300, 400], [100, 100, 1024, 400]], dtype=np.float32)
+    merged, groups = merge_detections(boxes, np.array([0.6, 0.9]), np.array([0, 0]),
+                                      np.array([0, CUT_RIGHT]))
+    assert groups == [[1, 0]]
+    assert merged[0].tolist() == [100, 100, 1300, 400]
+
+
+def test_merge_keeps_small_tree_inside_large_box():
+    boxes = np.array([[0, 0, 1000, 1000], [100, 100, 200, 200]], dtype=np.float32)
+    _, groups = merge_detections(boxes, np.array([0.9, 0.5]), np.array([0, 0]))
+    assert groups == [[0], [1]]
+
+
+def test_merge_keeps_different_classes():
+    boxes = np.array([[0, 0, 100, 100], [10, 10, 90, 90]], dtype=np.float32)
+    _, groups = merge_detections(boxes, np.array([0.9, 0.8]), np.array([0, 1]))
+    assert groups == [[0], [1]]
+
+
+def test_box_cuts_ignore_image_border():
+    region = (400, 0, 800, 400)
+    assert box_cuts(np.array([0, 10, 100, 100]), region, (400, 800)) == CUT_LEFT
+    assert box_cuts(np.array([300, 10, 400, 400]), region, (400, 800)) == 0
+
+
+def test_tile_masks_are_pasted_only_for_survivors():
+    regions = tile_regions((400, 800, 3), tile_size=400, overlap=0.0, max_tiles=4)
+    assert regions == [(0, 0, 800, 400), (0, 0, 400, 400), (400, 0, 800, 400)]
+
+    def detection(box, mask_box, confidence):
+        mask = np.zeros((1, 40, 40), dtype=np.float32)
+        x1, y1, x2, y2 = mask_box
+        mask[0, y1:y2, x1:x2] = 1
+        return DetectionResult(np.array([box], dtype=np.float32), np.array([confidence]),
+                               np.array([0]), {0: "tree"}, (400, 400), mask)
+
+    results = [
+        # Целый кадр: ничего не найдено
+        DetectionResult(np.zeros((0, 4), dtype=np.float32), np.zeros(0),
+                        np.zeros(0, dtype=int), {0: "tree"}, (400, 800)),
+        # Тайл 1: дерево в (100..200, 100..200), маска 40x40
+        detection([100, 100, 200, 200], (10, 10, 20, 20), 0.9),
+        # Тайл 2: дерево в (500..600, 100..300)
+        detection([100, 100, 200, 300], (10, 10, 20, 30), 0.5),
+    ]
+    merged = merge_tile_results(regions, results, (400, 800, 3), mask_long_side=400)
+
+    assert len(merged) == 2
+    assert merged.masks.dtype == np.uint8 and merged.masks.shape == (2, 200, 400)
+    ys, xs = np.nonzero(merged.masks[1])
+    assert (xs.min(), xs.max(), ys.min(), ys.max()) == (250, 299, 50, 149)
+
+
+def test_seam_split_tree_masks_are_joined():
+    regions = tile_regions((400, 800, 3), tile_size=400, overlap=0.0, max_tiles=4)
+
+    def detection(box, mask_box):
+        mask = np.zeros((1, 40, 40), dtype=np.float32)
+        x1, y1, x2, y2 = mask_box
+        mask[0, y1:y2, x1:x2] = 1
+        return DetectionResult(np.array([box], dtype=np.float32), np.array([0.8]),
+                               np.array([0]), {0: "tree"}, (400, 400), mask)
+
+    results = [
+        DetectionResult(np.zeros((0, 4), dtype=np.float32), np.zeros(0),
+                        np.zeros(0, dtype=int), {0: "tree"}, (400, 800)),
+        # Дерево (300..500, 100..200), разрезанное швом x=400
+        detection([300, 100, 400, 200], (30, 10, 40, 20)),
+        detection([0, 100, 100, 200], (0, 10, 10, 20)),
+    ]
+    merged = merge_tile_results(regions, results, (400, 800, 3), mask_long_side=400)
+
+    assert len(merged) == 1
+    assert merged.boxes[0].tolist() == [300, 100, 500, 200]
+    ys, xs = np.nonzero(merged.masks[0])
+    assert (xs.min(), xs.max(), ys.min(), ys.max()) == (150, 249, 50, 99)
@@ -0,0 +1,85 @@
+import asyncio
+
+from utils.upload_util import LocalStorage, MemoryStorage, UploadQueue
+
+
+class FlakyStorage(MemoryStorage):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    async def put(self, key, content):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("S3 недоступен")
+        await super().put(key, content)
+
+
+def test_queue_uploads_everything_before_stop():
+    storage = MemoryStorage()
+    queue = UploadQueue(storage, workers=2)
+
+    async def run():
+        await queue.put_many([(f"req/object_{i}.jpg", b"x" * i) for i in range(5)])
+        await queue.stop()
+
+    asyncio.run(run())
+    assert sorted(storage.files) == [f"req/object_{i}.jpg" for i in range(5)]
+    assert queue.pending_bytes == 0
+
+
+def test_queue_retries_with_backoff():
+    storage = FlakyStorage(failures=2)
+    queue = UploadQueue(storage, workers=1, max_attempts=3, retry_base_ms=1)
+
+    async def run():
+        await queue.put("req/annotated.jpg", b"data")
+        await queue.stop()
+
+    asyncio.run(run())
+    assert storage.attempts == 3
+    assert storage.files == {"req/annotated.jpg": b"data"}
+
+
+def test_queue_reports_failed_uploads():
+    failed = []
+    queue = UploadQueue(FlakyStorage(failures=5), workers=1, max_attempts=2, retry_base_ms=1)
+    queue.add_failure_listener(failed.append)
+
+    async def run():
+        await queue.put("req/annotated.jpg", b"data")
+        await queue.stop()
+
+    asyncio.run(run())
+    assert failed == ["req/annotated.jpg"]
+
+
+def test_queue_applies_backpressure_on_memory_budget():
+    release = asyncio.Event()
+    uploaded = []
+
+    class SlowStorage:
+        async def put(self, key, content):
+            await release.wait()
+            uploaded.append(key)
+
+    queue = UploadQueue(SlowStorage(), workers=1, max_bytes=10)
+
+    async def run():
+        await queue.put("a", b"x" * 6)
+        blocked = asyncio.create_task(queue.put("b", b"x" * 6))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        release.set()
+        await blocked
+        await queue.stop()
+
+    asyncio.run(run())
+    assert uploaded == ["a", "b"]
+
+
+def test_local_storage_writes_files(tmp_path):
+    storage = LocalStorage(tmp_path)
+    asyncio.run(storage.put("req/object_0_tree.jpg", b"jpeg"))
+    assert (tmp_path / "req" / "object_0_tree.jpg").read_bytes() == b"jpeg"
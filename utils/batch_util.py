@@ -0,0 +1,171 @@
+import asyncio
+import time
+from typing import Any, Callable, List, Optional, Set
+
+from settings import logger
+from utils.executor_util import InferenceExecutor
+from utils.metrics_util import metrics
+
+# Бакеты гистограммы времени ожидания в очереди, мс
+WAIT_MS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class MicroBatcher:
+    '''
+    Асинхронный микро-батчер.
+
+    Собирает элементы от конкурентных запросов в очередь и обрабатывает их
+    пачками: батч закрывается при достижении max_batch_size или по истечении
+    max_wait_ms с момента прихода первого элемента. Результаты раздаются
+    обратно ожидающим future в том же порядке.
+
+    Одновременно выполняется до max_concurrency батчей: пока все слоты
+    заняты, следующий батч продолжает набираться в очереди.
+    '''
+
+    def __init__(
+        self,
+        name: str,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 8.0,
+        executor: Optional[InferenceExecutor] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        '''
+        Args:
+            name: имя батчера (префикс метрик)
+            process_batch: синхронная функция, обрабатывающая список элементов
+                и возвращающая список результатов той же длины
+            max_batch_size: максимальный размер батча
+            max_wait_ms: максимальное ожидание добора батча, мс
+            executor: исполнитель для process_batch (по умолчанию поток
+                из asyncio.to_thread)
+            max_concurrency: батчей в обработке одновременно (по умолчанию
+                executor.model_concurrency, без исполнителя - 1)
+        '''
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        if max_concurrency is None:
+            max_concurrency = executor.model_concurrency if executor is not None else 1
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.batch_sizes = metrics.histogram(f"{name}_batch_size")
+        self.queue_depths = metrics.histogram(f"{name}_queue_depth")
+        self.wait_times = metrics.histogram(f"{name}_wait_ms", WAIT_MS_BUCKETS)
+        metrics.gauge(f"{name}_queue_depth", self.qsize)
+        metrics.gauge(f"{name}_inflight", lambda: len(self._inflight))
+
+    def qsize(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Батчер {self.name} запущен")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            for task in self._inflight:
+                task.cancel()
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+            self._inflight.clear()
+            logger.info(f"Батчер {self.name} остановлен")
+
+    async def submit(self, item: Any) -> Any:
+        '''
+        Ставит элемент в очередь и ждёт результат его обработки.
+        '''
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.monotonic()))
+        return await future
+
+    async def submit_many(self, items: List[Any]) -> List[Any]:
+        '''
+        Ставит в очередь несколько элементов одного запроса.
+        '''
+        return list(await asyncio.gather(*(self.submit(item) for item in items)))
+
+    async def _collect(self) -> list:
+        batch = [await self.queue.get()]
+        self.queue_depths.observe(self.queue.qsize() + 1)
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.max_concurrency)
+
+        def release(task: asyncio.Task):
+            self._inflight.discard(task)
+            slots.release()
+
+        while True:
+            await slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                slots.release()
+                raise
+            task = asyncio.create_task(self._process(batch))
+            self._inflight.add(task)
+            task.add_done_callback(release)
+
+    async def _process(self, batch: list):
+        now = time.monotonic()
+        for _, _, enqueued_at in batch:
+            self.wait_times.observe((now - enqueued_at) * 1000)
+        self.batch_sizes.observe(len(batch))
+
+        items = [item for item, _, _ in batch]
+        try:
+            if self.executor is not None:
+                results = await self.executor.run(self.process_batch, items)
+            else:
+                results = await asyncio.to_thread(self.process_batch, items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"Батчер {self.name}: получено {len(results)} "
+                    f"результатов для {len(items)} элементов"
+                )
+        except asyncio.CancelledError:
+            for _, future, _ in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка обработки батча {self.name}: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
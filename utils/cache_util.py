@@ -0,0 +1,448 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import diskcache
+
+from clip.clip_inferense import problem_translation_dict, translation_dict
+from clip.embedding_bank import file_sha256
+from schemas.schemas import PredictSchema
+from segmentator.segmentator_inferense import resolve_weights_path
+from settings import (
+    CLIP_DEFECT_THRESHOLD,
+    CLIP_MODEL_NAME,
+    CLIP_WEIGHTS_PATH,
+    DECODE_TARGET_LONG_SIDE,
+    DETECTOR_CONF,
+    DETECTOR_IMGSZ,
+    DETECTOR_IOU,
+    DETECTOR_MAX_TILES,
+    DETECTOR_TILE_NMS_IOU,
+    DETECTOR_TILE_OVERLAP,
+    DETECTOR_TILE_SIZE,
+    DETECTOR_TILING,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK_MB,
+    RESULT_CACHE_MAX_ITEMS,
+    RESULT_CACHE_TTL,
+    logger,
+)
+from utils.fs_util import commit_generation, directory_lock
+from utils.metrics_util import metrics
+from utils.s3_util import is_upload_error
+
+# Хэши файлов весов: (путь, mtime, размер) -> sha256
+_file_hashes: dict = {}
+
+
+def content_hash(data: bytes) -> str:
+    '''
+    sha256 загруженного файла (hashlib отпускает GIL на больших данных).
+    '''
+    return hashlib.sha256(data).hexdigest()
+
+
+def weights_hash(path) -> str:
+    '''
+    sha256 файла весов, пересчитывается только при изменении файла.
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        _file_hashes[key] = file_sha256(path)
+    return _file_hashes[key]
+
+
+def models_version() -> str:
+    '''
+    Версия пайплайна для ключей кэша: хэши весов детектора и CLIP, промпты,
+    пороги и параметры, от которых зависит результат скана.
+    '''
+    try:
+        detector_path = resolve_weights_path()
+    except FileNotFoundError:
+        detector_path = None
+    payload = json.dumps({
+        "detector": weights_hash(detector_path) if detector_path else "missing",
+        "classifier": weights_hash(CLIP_WEIGHTS_PATH),
+        "clip_model": CLIP_MODEL_NAME,
+        "species": list(translation_dict.keys()),
+        "defects": list(problem_translation_dict.keys()),
+        "decode": DECODE_TARGET_LONG_SIDE,
+        "tiling": [DETECTOR_TILING, DETECTOR_TILE_SIZE, DETECTOR_TILE_OVERLAP,
+                   DETECTOR_MAX_TILES, DETECTOR_TILE_NMS_IOU],
+        "thresholds": [DETECTOR_CONF, DETECTOR_IOU, DETECTOR_IMGSZ,
+                       CLIP_DEFECT_THRESHOLD],
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ResultCache:
+    '''
+    Кэш результатов скана (PredictSchema с уже загруженными URL) по хэшу
+    содержимого фото.
+
+    Первый уровень - LRU в памяти на max_items записей, второй
+    (необязательный) - diskcache в disk_dir с ограничением размера. У записей
+    есть TTL. Ключ включает версию моделей (models_version), при
+    перезагрузке моделей с другими весами кэш сбрасывается (invalidate).
+
+    В режимах отложенной загрузки (очередь загрузок, фоновая отрисовка)
+    результат кэшируется до загрузки файлов: если загрузка потом не
+    удалась, записи этого запроса удаляются (evict_request).
+
+    Записи памяти сохраняются в снимок (snapshot): JSON результатов подряд
+    в файле данных и индекс (ключ, срок, смещение, длина) в
+    result_cache.json. При старте (restore) файл данных открывается через
+    memory map, JSON записи читается и разбирается только при первом
+    обращении к ней.
+    '''
+
+    snapshot_meta = "result_cache.json"
+    snapshot_prefix = "result_cache_"
+
+    def __init__(
+        self,
+        max_items: int = 1024,
+        ttl: float = 86400,
+        disk_dir: Optional[str] = None,
+        disk_size_limit: int = 512 * 1024 * 1024,
+    ):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_size_limit = disk_size_limit
+        self.version = ""
+        self._items: "OrderedDict[str, tuple[float, PredictSchema]]" = OrderedDict()
+        # Записи снимка, ещё не перенесённые в память:
+        # ключ -> (срок, смещение, длина) в self._snapshot_data (mmap)
+        self._restored: Dict[str, tuple[float, int, int]] = {}
+        self._snapshot_data: Optional[mmap.mmap] = None
+        # Ключи кэша недавних запросов (по request_id из URL файлов) и
+        # запросы с неудачной загрузкой
+        self._requests: "OrderedDict[str, set]" = OrderedDict()
+        self._failed: "OrderedDict[str, None]" = OrderedDict()
+        # Ключи, удаление которых с диска ещё идёт, и задачи удаления
+        self._deleting: set = set()
+        self._tasks: set = set()
+        self._lock = threading.Lock()
+        self._disk = None
+        metrics.gauge("result_cache_items", lambda: len(self._items))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0
+
+    @property
+    def disk(self):
+        if self._disk is None and self.disk_dir:
+            self._disk = diskcache.Cache(
+                self.disk_dir,
+                size_limit=self.disk_size_limit,
+                eviction_policy="least-recently-used",
+            )
+            logger.info(f"Дисковый кэш результатов открыт в {self.disk_dir}")
+        return self._disk
+
+    def refresh_version(self, *_) -> bool:
+        '''
+        Пересчитывает версию моделей. Если версия изменилась, сбрасывает кэш.
+        Подписывается на загрузку моделей в registry.
+
+        Returns:
+            bool: изменилась ли версия
+        '''
+        version = models_version()
+        if version == self.version:
+            return False
+        if self.version:
+            logger.info(f"Версия моделей изменилась ({self.version} -> {version})")
+            self.invalidate()
+        self.version = version
+        return True
+
+    def make_key(self, image_hash: str, **params) -> str:
+        '''
+        Ключ кэша: версия моделей, хэш фото и параметры запроса.
+        '''
+        if not self.version:
+            self.refresh_version()
+        suffix = ",".join(f"{name}={value}" for name, value in sorted(params.items()))
+        return f"{self.version}:{image_hash}:{suffix}"
+
+    def _get_memory(self, key: str) -> Optional[PredictSchema]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None and key in self._restored:
+                expires_at, offset, length = self._restored.pop(key)
+                payload = self._snapshot_data[offset:offset + length]
+                item = (expires_at, PredictSchema.model_validate_json(payload))
+                self._items[key] = item
+                metrics.inc("result_cache_restored")
+            if item is None:
+                return None
+            expires_at, predict = item
+            if expires_at < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return predict
+
+    def _set_memory(self, key: str, predict: PredictSchema, expires_at: float):
+        with self._lock:
+            self._items[key] = (expires_at, predict)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                metrics.inc("result_cache_evictions")
+
+    async def get(self, key: str) -> Optional[PredictSchema]:
+        if not self.enabled:
+            return None
+        predict = self._get_memory(key)
+        if predict is None and self.disk is not None and key not in self._deleting:
+            payload, expires_at = await asyncio.to_thread(
+                self.disk.get, key, expire_time=True
+            )
+            if payload is not None and key not in self._deleting:
+                predict = PredictSchema.model_validate_json(payload)
+                # В памяти запись живёт до исходного срока дисковой записи
+                self._set_memory(key, predict, expires_at or time.time() + self.ttl)
+                metrics.inc("result_cache_disk_hits")
+        if predict is None:
+            metrics.inc("result_cache_misses")
+            return None
+        metrics.inc("result_cache_hits")
+        return predict.model_copy(deep=True)
+
+    async def set(self, key: str, predict: PredictSchema, request_id: Optional[str] = None):
+        '''
+        Сохраняет результат. Результаты с неудачными загрузками не кэшируются,
+        чтобы повторный запрос загрузил файлы заново. request_id - запрос,
+        под которым загружаются файлы результата (для evict_request).
+        '''
+        if not self.enabled:
+            return
+        urls = [predict.framed_url] + [plant.crop_url for plant in predict.plants]
+        if any(is_upload_error(url) for url in urls):
+            return
+        if request_id is not None:
+            request_id = str(request_id)
+            with self._lock:
+                if request_id in self._failed:
+                    return
+                self._requests.setdefault(request_id, set()).add(key)
+                self._requests.move_to_end(request_id)
+                while len(self._requests) > self.max_items:
+                    self._requests.popitem(last=False)
+        predict = predict.model_copy(deep=True)
+        self._set_memory(key, predict, time.time() + self.ttl)
+        if self.disk is not None:
+            await asyncio.to_thread(
+                self.disk.set, key, predict.model_dump_json(), expire=self.ttl
+            )
+
+    def evict_request(self, request_id: str):
+        '''
+        Удаляет результаты, файлы которых загружаются под request_id, и не
+        даёт закэшировать их позже (загрузка не удалась).
+        '''
+        request_id = str(request_id)
+        with self._lock:
+            self._failed[request_id] = None
+            while len(self._failed) > self.max_items:
+                self._failed.popitem(last=False)
+            keys = self._requests.pop(request_id, set())
+            for key in keys:
+                self._items.pop(key, None)
+                self._restored.pop(key, None)
+            if keys and self.disk is not None:
+                self._deleting.update(keys)
+        if keys and self.disk is not None:
+            self._schedule_disk_delete(keys)
+        if keys:
+            metrics.inc("result_cache_upload_evictions", len(keys))
+            logger.info(f"Из кэша удалены результаты запроса {request_id}: загрузка не удалась")
+
+    def _delete_disk(self, disk, keys: set):
+        try:
+            for key in keys:
+                disk.delete(key)
+        finally:
+            with self._lock:
+                self._deleting.difference_update(keys)
+
+    def _schedule_disk_delete(self, keys: set):
+        '''
+        Удаляет keys из дискового кэша в потоке, чтобы не блокировать event
+        loop. Пока удаление идёт, get не читает эти ключи с диска.
+        '''
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._delete_disk(self.disk, keys)
+            return
+        task = loop.create_task(asyncio.to_thread(self._delete_disk, self.disk, keys))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def evict_object(self, key: str):
+        '''
+        Обработчик неудачной загрузки файла с ключом бакета {request_id}/{файл}.
+        '''
+        self.evict_request(key.split("/", 1)[0])
+
+    def invalidate(self):
+        '''
+        Полностью очищает кэш (память и диск).
+        '''
+        with self._lock:
+            self._items.clear()
+            self._restored.clear()
+        if self.disk is not None:
+            self.disk.clear()
+        metrics.inc("result_cache_invalidations")
+        logger.info("Кэш результатов сброшен")
+
+    def snapshot(self, directory: str) -> int:
+        '''
+        Сохраняет непросроченные записи памяти (и ещё не восстановленные
+        записи прошлого снимка) в directory новым поколением снимка.
+
+        Returns:
+            int: количество сохранённых записей
+        '''
+        now = time.time()
+        with self._lock:
+            payloads = [
+                (key, expires_at, self._snapshot_data[offset:offset + length])
+                for key, (expires_at, offset, length) in self._restored.items()
+                if expires_at > now
+            ]
+            items = list(self._items.items())
+        payloads += [
+            (key, expires_at, predict.model_dump_json().encode("utf-8"))
+            for key, (expires_at, predict) in items
+            if expires_at > now
+        ]
+        payloads = payloads[-self.max_items:]
+
+        entries, offset = [], 0
+        for key, expires_at, payload in payloads:
+            entries.append([key, expires_at, offset, len(payload)])
+            offset += len(payload)
+        directory = Path(directory)
+        generation = uuid.uuid4().hex[:12]
+        with directory_lock(directory, exclusive=True):
+            data_path = directory / f"{self.snapshot_prefix}data.{generation}.bin"
+            with open(data_path, "wb") as f:
+                for _, _, payload in payloads:
+                    f.write(payload)
+            commit_generation(directory, self.snapshot_meta, {
+                "version": self.version,
+                "generation": generation,
+                "size": offset,
+                "entries": entries,
+            }, self.snapshot_prefix)
+        return len(entries)
+
+    def restore(self, directory: str) -> int:
+        '''
+        Подключает снимок из directory, если он сделан для текущей версии
+        моделей. Просроченные записи отбрасываются, файл данных открывается
+        через memory map.
+
+        Returns:
+            int: количество восстановленных записей
+        '''
+        if not self.version:
+            self.refresh_version()
+        directory = Path(directory)
+        try:
+            with directory_lock(directory, exclusive=False):
+                meta = json.loads((directory / self.snapshot_meta).read_text(encoding="utf-8"))
+                if meta.get("version") != self.version:
+                    logger.info("Снимок кэша результатов устарел, пропускаю")
+                    return 0
+                data_path = directory / f"{self.snapshot_prefix}data.{meta['generation']}.bin"
+                if meta["size"] == 0:
+                    return 0
+                with open(data_path, "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, KeyError) as e:
+            logger.info(f"Снимок кэша результатов не загружен: {e}")
+            return 0
+        if len(data) != meta["size"]:
+            logger.warning("Снимок кэша результатов повреждён, пропускаю")
+            data.close()
+            return 0
+        now = time.time()
+        with self._lock:
+            self._snapshot_data = data
+            self._restored = {
+                key: (expires_at, offset, length)
+                for key, expires_at, offset, length in meta.get("entries", [])
+                if expires_at > now and key not in self._items
+            }
+            return len(self._restored)
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+class SingleFlight:
+    '''
+    Объединение одинаковых одновременных вызовов (single-flight).
+
+    Первый вызов с ключом key запускает func отдельной задачей, остальные
+    вызовы с тем же ключом до её завершения ждут ту же задачу и получают
+    тот же результат (или ту же ошибку). Задача не отменяется, если
+    отменён запрос, который её запустил: её могут ждать другие запросы.
+    '''
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        metrics.gauge(f"{name}_inflight", lambda: len(self._calls))
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Ошибка уже передана ожидающим, помечаем её обработанной
+            task.exception()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+            metrics.inc(f"{self.name}_leaders")
+        else:
+            metrics.inc(f"{self.name}_coalesced")
+        return await asyncio.shield(task)
+
+
+result_cache = ResultCache(
+    max_items=RESULT_CACHE_MAX_ITEMS,
+    ttl=RESULT_CACHE_TTL,
+    disk_dir=RESULT_CACHE_DIR or None,
+    disk_size_limit=RESULT_CACHE_DISK_MB * 1024 * 1024,
+)
+
+# Одинаковые одновременные сканы (по ключу result_cache) выполняются один раз
+scan_flights = SingleFlight("scan_flight")
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+from segmentator.segmentator_inferense import encode_image
+from settings import ENCODE_WORKERS, logger
+from utils.metrics_util import metrics
+
+# Бакеты гистограммы времени кодирования, мс
+ENCODE_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class ImageEncoder:
+    '''
+    Пул потоков для JPEG кодирования кропов и фото с рамками.
+
+    cv2.imencode отпускает GIL, поэтому изображения одного запроса
+    кодируются параллельно. Пул ограничен, а потоки torch в процессе
+    уменьшаются так, чтобы вместе с кодированием не превышать число ядер
+    (в воркерах process/fork это делает InferenceExecutor).
+    Время каждого кодирования пишется в гистограммы encode_{kind}_ms.
+    '''
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self.start()
+        return self._executor
+
+    def start(self):
+        if self._executor is not None:
+            return
+        cpu_count = os.cpu_count() or 1
+        torch_threads = torch.get_num_threads()
+        if torch_threads + self.max_workers > cpu_count:
+            torch.set_num_threads(max(1, cpu_count - self.max_workers))
+            logger.info(
+                f"Потоки torch: {torch_threads} -> {torch.get_num_threads()} "
+                f"(резерв {self.max_workers} под кодирование)"
+            )
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="encode",
+        )
+        logger.info(f"Запущен пул кодирования на {self.max_workers} потоков")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            logger.info("Пул кодирования остановлен")
+
+    @staticmethod
+    def _encode(image: np.ndarray, kind: str, image_format: str,
+                quality: int) -> bytes | None:
+        start = time.perf_counter()
+        image_bytes = encode_image(image, image_format, quality)
+        metrics.histogram(f"encode_{kind}_ms", ENCODE_MS_BUCKETS).observe(
+            (time.perf_counter() - start) * 1000
+        )
+        return image_bytes
+
+    async def encode(self, image: np.ndarray, kind: str = "crop",
+                     image_format: str = 'jpg', quality: int = 95) -> bytes | None:
+        '''
+        Кодирует изображение в пуле, не блокируя event loop.
+
+        Args:
+            image: изображение в BGR
+            kind: тип изображения для метрик (crop, annotated)
+            image_format: формат изображения ('jpg', 'png')
+            quality: качество для JPEG (0-100)
+
+        Returns:
+            bytes: закодированное изображение или None при ошибке
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._encode, image, kind, image_format, quality
+        )
+
+    async def encode_many(self, images: List[np.ndarray], kind: str = "crop",
+                          image_format: str = 'jpg',
+                          quality: int = 95) -> List[bytes | None]:
+        '''
+        Кодирует несколько изображений одновременно, результаты в порядке images.
+        '''
+        return list(await asyncio.gather(
+            *(self.encode(image, kind, image_format, quality) for image in images)
+        ))
+
+
+image_encoder = ImageEncoder(ENCODE_WORKERS)
@@ -0,0 +1,171 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import torch
+
+from segmentator.segmentator_inferense import warmup_yolo_model
+from settings import (
+    ENCODE_WORKERS,
+    INFERENCE_EXECUTOR,
+    INFERENCE_WORKER_THREADS,
+    INFERENCE_WORKERS,
+    logger,
+)
+from utils.models_util import registry
+
+
+def _init_process_worker(num_threads: int):
+    '''
+    Инициализация процесса-воркера: модели загружаются один раз на воркер.
+    '''
+    torch.set_num_threads(num_threads)
+    registry.load_all()
+
+
+def _init_forked_worker(num_threads: int):
+    '''
+    Инициализация воркера, созданного через fork: модели уже загружены
+    в родителе и доступны через унаследованный registry.
+    '''
+    torch.set_num_threads(num_threads)
+
+
+def _worker_pid(_=None) -> int:
+    return os.getpid()
+
+
+class InferenceExecutor:
+    '''
+    Исполнитель CPU-bound этапов инференса вне event loop.
+
+    kind="thread" - пул потоков (модели общие для всего процесса),
+    kind="process" - пул процессов (spawn), в каждом воркере свои модели,
+    kind="fork" - модели загружаются один раз в родителе, после чего
+    воркеры создаются через fork и разделяют веса (разделяемая память
+    torch / copy-on-write). Работает только на CPU.
+    В режимах process и fork задачи и их аргументы должны сериализоваться
+    pickle, поэтому через исполнитель передаются функции уровня модуля.
+    Потоки torch воркеров (worker_threads) уменьшаются так, чтобы вместе с
+    reserved_threads потоками кодирования JPEG не превышать число ядер.
+    '''
+
+    kinds = ("thread", "process", "fork")
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: int = 4,
+        worker_threads: int = 1,
+        reserved_threads: int = 0,
+    ):
+        if kind not in self.kinds:
+            raise ValueError(
+                f"Неизвестный тип исполнителя {kind}, ожидается один из {self.kinds}"
+            )
+        if kind == "fork" and torch.cuda.is_available():
+            logger.warning("Режим fork недоступен с CUDA, используется process")
+            kind = "process"
+        self.kind = kind
+        self.max_workers = max_workers
+        self.worker_threads = worker_threads
+        self.reserved_threads = reserved_threads
+        self.worker_pids: list = []
+        self._executor: Optional[Executor] = None
+
+    @property
+    def model_concurrency(self) -> int:
+        '''
+        Сколько вызовов одной модели можно выполнять одновременно. В режимах
+        process и fork у каждого воркера своя копия модели, в режиме thread
+        модель (предиктор Ultralytics) общая и не потокобезопасна.
+        '''
+        return 1 if self.kind == "thread" else self.max_workers
+
+    def worker_num_threads(self) -> int:
+        '''
+        Потоки torch одного процесса-воркера с учётом резерва под кодирование.
+        '''
+        cpu_count = os.cpu_count() or 1
+        if self.worker_threads * self.max_workers + self.reserved_threads <= cpu_count:
+            return self.worker_threads
+        num_threads = max(1, (cpu_count - self.reserved_threads) // self.max_workers)
+        logger.info(
+            f"Потоки torch воркера: {self.worker_threads} -> {num_threads} "
+            f"(резерв {self.reserved_threads} под кодирование)"
+        )
+        return num_threads
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self.start()
+        return self._executor
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+                initargs=(self.worker_num_threads(),),
+            )
+        elif self.kind == "fork":
+            self._start_forked_pool()
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="inference",
+            )
+        logger.info(
+            f"Запущен исполнитель инференса {self.kind} на {self.max_workers} воркеров"
+        )
+
+    def _start_forked_pool(self):
+        '''
+        Загружает и прогревает модели в родителе, переносит веса в разделяемую
+        память и сразу создаёт все воркеры, пока состояние моделей неизменно.
+        '''
+        registry.load_all()
+        warmup_yolo_model(registry.get("detector"))
+        registry.share_memory()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_forked_worker,
+            initargs=(self.worker_num_threads(),),
+        )
+        # Для fork ProcessPoolExecutor создаёт все процессы при первой задаче
+        self.worker_pids = sorted(
+            set(self._executor.map(_worker_pid, range(self.max_workers)))
+        )
+        logger.info(f"Воркеры инференса созданы через fork: {self.worker_pids}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logger.info(f"Исполнитель инференса {self.kind} остановлен")
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        '''
+        Выполняет func(*args, **kwargs) в пуле и ждёт результат, не блокируя
+        event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+
+inference_executor = InferenceExecutor(
+    INFERENCE_EXECUTOR,
+    INFERENCE_WORKERS,
+    INFERENCE_WORKER_THREADS,
+    ENCODE_WORKERS,
+)
@@ -0,0 +1,37 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def directory_lock(directory: Path, exclusive: bool):
+    '''
+    Блокировка (flock) директории, общая между процессами: чтение банков и
+    снимков берёт разделяемую блокировку, запись и удаление старых файлов -
+    эксклюзивную.
+    '''
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def commit_generation(directory: Path, meta_name: str, meta: dict, prefix: str):
+    '''
+    Завершает запись поколения снимка meta["generation"]: файлы поколения
+    (prefix*.{generation}.*) уже записаны, meta файл со ссылкой на них
+    атомарно заменяется, после чего файлы прошлых поколений удаляются.
+    Вызывается под эксклюзивной directory_lock.
+    '''
+    meta_path = directory / meta_name
+    tmp_path = meta_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, meta_path)
+    for path in directory.glob(f"{prefix}*"):
+        if path != meta_path and f".{meta['generation']}." not in path.name:
+            path.unlink()
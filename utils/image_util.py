@@ -0,0 +1,190 @@
+import struct
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from pydantic import BaseModel, ConfigDict, Field
+
+from settings import DECODE_TARGET_LONG_SIDE
+
+# Сигнатуры форматов, которые декодирует cv2.imdecode: (смещение, байты, формат)
+IMAGE_SIGNATURES = (
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (8, b"WEBP", "webp"),
+    (0, b"BM", "bmp"),
+    (0, b"II*\x00", "tiff"),
+    (0, b"MM\x00*", "tiff"),
+    (0, b"\x00\x00\x00\x0cjP  \r\n\x87\n", "jpeg2000"),
+    (0, b"\xff\x4f\xff\x51", "jpeg2000"),
+    (4, b"ftypavif", "avif"),
+    (4, b"ftypavis", "avif"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (0, b"Y\xa6j\x95", "sunras"),
+    (0, b"#?RADIANCE", "hdr"),
+    (0, b"#?RGBE", "hdr"),
+    (0, b"PF", "pfm"),
+    (0, b"Pf", "pfm"),
+    (0, b"P1", "pnm"),
+    (0, b"P2", "pnm"),
+    (0, b"P3", "pnm"),
+    (0, b"P4", "pnm"),
+    (0, b"P5", "pnm"),
+    (0, b"P6", "pnm"),
+    (0, b"P7", "pam"),
+)
+
+# Уменьшенное декодирование: (во сколько раз, флаг OpenCV)
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Маркеры JPEG SOF, в которых записан размер кадра
+JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF,
+}
+
+
+class DecodedImage(BaseModel):
+    """
+    Загруженное фото, декодированное один раз на входе запроса.
+    Передаётся по всему пайплайну вместо повторного декодирования bytes.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    array: np.ndarray = Field(description="Изображение в BGR, uint8")
+    shape: tuple = Field(description="Размер изображения (H, W, C)")
+    source_format: Optional[str] = Field(
+        default=None,
+        description="Формат исходного файла (jpeg, png, ...)"
+    )
+    original_bytes: bytes = Field(
+        default=b"",
+        repr=False,
+        description="Исходные bytes загруженного файла"
+    )
+
+
+def sniff_image_format(image_bytes: bytes) -> Optional[str]:
+    """Определяет формат изображения по сигнатуре в заголовке."""
+    for offset, signature, image_format in IMAGE_SIGNATURES:
+        if image_bytes[offset:offset + len(signature)] == signature:
+            return image_format
+    return None
+
+
+def read_image_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Читает размер (ширина, высота) из заголовка JPEG или PNG без декодирования.
+    Для остальных форматов и битых заголовков возвращает None.
+    """
+    image_format = sniff_image_format(image_bytes)
+    try:
+        if image_format == "png":
+            width, height = struct.unpack(">II", image_bytes[16:24])
+            return width, height
+        if image_format == "jpeg":
+            offset = 2
+            while offset + 9 < len(image_bytes):
+                if image_bytes[offset] != 0xFF:
+                    return None
+                marker = image_bytes[offset + 1]
+                if marker == 0xFF:
+                    offset += 1
+                    continue
+                length = struct.unpack(">H", image_bytes[offset + 2:offset + 4])[0]
+                if marker in JPEG_SOF_MARKERS:
+                    height, width = struct.unpack(
+                        ">HH", image_bytes[offset + 5:offset + 9]
+                    )
+                    return width, height
+                offset += 2 + length
+    except struct.error:
+        return None
+    return None
+
+
+def check_image_header(image_bytes: bytes) -> str:
+    """
+    Быстрая проверка bytes изображения по заголовку, без декодирования:
+    сигнатура формата, который умеет декодировать cv2.imdecode
+    (IMAGE_SIGNATURES), а для JPEG и PNG - читаемый ненулевой размер.
+    Полностью файл проверяется только при декодировании: decode_image
+    начинает с этой же проверки, поэтому /scan и /scan/jobs принимают
+    одни и те же файлы.
+
+    Returns:
+        str: формат изображения
+
+    Raises:
+        ValueError: если bytes не похожи на изображение
+    """
+    if not image_bytes:
+        raise ValueError("Пустые bytes изображения")
+    image_format = sniff_image_format(image_bytes)
+    if image_format is None:
+        raise ValueError("Неизвестный формат изображения")
+    if image_format in ("jpeg", "png"):
+        size = read_image_size(image_bytes)
+        if size is None or min(size) == 0:
+            raise ValueError(f"Некорректный заголовок {image_format}")
+    return image_format
+
+
+def choose_decode_flag(
+    image_bytes: bytes,
+    target_long_side: int = DECODE_TARGET_LONG_SIDE,
+) -> Tuple[int, int]:
+    """
+    Выбирает максимальное уменьшение при декодировании, при котором длинная
+    сторона остаётся не меньше target_long_side.
+
+    Returns:
+        (флаг cv2.imdecode, во сколько раз уменьшается изображение)
+    """
+    size = read_image_size(image_bytes)
+    if size is None or not target_long_side:
+        return cv2.IMREAD_COLOR, 1
+    long_side = max(size)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if long_side / factor >= target_long_side:
+            return flag, factor
+    return cv2.IMREAD_COLOR, 1
+
+
+def decode_image(
+    image_bytes: bytes,
+    target_long_side: int = DECODE_TARGET_LONG_SIDE,
+) -> DecodedImage:
+    """
+    Декодирует bytes изображения в BGR массив.
+
+    Большие фото декодируются сразу в уменьшенном виде
+    (IMREAD_REDUCED_COLOR_2/4/8), если длинная сторона после уменьшения
+    остаётся не меньше target_long_side. Этого достаточно для детектора
+    (640 px) и кропов для CLIP (256 px), а время декодирования и память
+    падают в разы. Весь пайплайн работает с уменьшенным фото: кропы и фото
+    с рамками тоже получаются в уменьшенном разрешении, координаты в
+    исходное фото не пересчитываются. target_long_side=0 отключает
+    уменьшение.
+
+    Raises:
+        ValueError: если bytes не являются корректным изображением
+    """
+    source_format = check_image_header(image_bytes)
+    flag, _ = choose_decode_flag(image_bytes, target_long_side)
+    np_arr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(np_arr, flag)
+    if image is None:
+        raise ValueError("Не удалось декодировать изображение из bytes")
+
+    return DecodedImage(
+        array=image,
+        shape=image.shape,
+        source_format=source_format,
+        original_bytes=image_bytes,
+    )
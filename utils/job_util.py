@@ -0,0 +1,198 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from schemas.schemas import JobStatus, PredictSchema, ScanJobResponse, ScanResponse
+from settings import (
+    SCAN_JOB_MAX_PENDING,
+    SCAN_JOB_MAX_PENDING_MB,
+    SCAN_JOB_MAX_STORED,
+    SCAN_JOB_RESULT_TTL,
+    SCAN_JOB_WORKERS,
+    logger,
+)
+from utils.metrics_util import metrics
+
+# Бакеты гистограмм ожидания в очереди и выполнения задачи, мс
+JOB_MS_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class JobQueueFull(Exception):
+    '''
+    Очередь задач заполнена, новую задачу нужно отправить позже.
+    '''
+
+
+class ScanJobQueue:
+    '''
+    Локальная очередь асинхронных задач скана.
+
+    submit сразу возвращает задачу со статусом queued, воркеры выполняют
+    handler(payload) и сохраняют результат. Ограничены число задач,
+    ожидающих выполнения (max_pending), суммарный размер их payload
+    (max_pending_bytes) и число хранимых задач вместе с завершёнными
+    (max_stored, в том числе сразу выполненных из кэша): при превышении
+    submit бросает JobQueueFull. Payload освобождается, как только задача
+    завершена, сама задача с результатом хранится result_ttl секунд.
+
+    Другой брокер (например, Redis) может заменить очередь, реализовав те же
+    start, submit, get и stop.
+    '''
+
+    def __init__(self, workers: int = 4, max_pending: int = 64,
+                 max_pending_bytes: int = 256 * 1024 * 1024, max_stored: int = 10000,
+                 result_ttl: float = 3600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self.max_stored = max_stored
+        self.result_ttl = result_ttl
+        self.pending_bytes = 0
+        self.handler: Optional[Callable[[Any], Awaitable[PredictSchema]]] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._jobs: Dict[str, ScanJobResponse] = {}
+        # Завершённые задачи в порядке завершения: id -> момент удаления
+        self._expires: "OrderedDict[str, float]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+
+        self.wait_ms = metrics.histogram("scan_job_wait_ms", JOB_MS_BUCKETS)
+        self.run_ms = metrics.histogram("scan_job_run_ms", JOB_MS_BUCKETS)
+        metrics.gauge("scan_jobs_pending", self.qsize)
+        metrics.gauge("scan_jobs_stored", lambda: len(self._jobs))
+        metrics.gauge("scan_jobs_pending_bytes", lambda: self.pending_bytes)
+
+    def qsize(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def start(self, handler: Callable[[Any], Awaitable[PredictSchema]]):
+        if self._tasks:
+            return
+        self.handler = handler
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.pending_bytes = 0
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        logger.info(
+            f"Очередь задач скана запущена: {self.workers} воркеров, "
+            f"до {self.max_pending} задач в очереди"
+        )
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._expires:
+            job_id, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                break
+            del self._expires[job_id]
+            self._jobs.pop(job_id, None)
+            metrics.inc("scan_jobs_expired")
+
+    def _finish(self, job: ScanJobResponse, status: JobStatus):
+        job.status = status
+        job.finished_at = datetime.now().isoformat()
+        self._expires[job.id] = time.monotonic() + self.result_ttl
+        metrics.inc(f"scan_jobs_{status.value}")
+
+    def _reject(self, reason: str):
+        metrics.inc("scan_jobs_rejected")
+        raise JobQueueFull(reason)
+
+    def submit(self, payload: Any = None, result: Optional[PredictSchema] = None,
+               size: int = 0) -> ScanJobResponse:
+        '''
+        Создаёт задачу. Если результат уже известен (например, из кэша),
+        задача сразу считается выполненной. size - размер payload в байтах
+        (для бюджета max_pending_bytes).
+
+        Raises:
+            JobQueueFull: в очереди уже max_pending задач или
+                max_pending_bytes байт, либо хранится max_stored задач
+        '''
+        if self.queue is None:
+            raise RuntimeError("Очередь задач скана не запущена")
+        self._purge()
+        if len(self._jobs) >= self.max_stored:
+            self._reject(f"Хранится уже {self.max_stored} задач скана")
+        if result is None and self.pending_bytes + size > self.max_pending_bytes:
+            self._reject(
+                f"Фото в очереди задач скана занимают "
+                f"{self.pending_bytes / 1024 / 1024:.0f} МБ"
+            )
+        job = ScanJobResponse(
+            id=str(uuid.uuid4()),
+            status=JobStatus.queued,
+            created_at=datetime.now().isoformat(),
+        )
+        if result is not None:
+            job.result = ScanResponse(id=job.id, predict=result)
+            self._finish(job, JobStatus.done)
+        else:
+            try:
+                self.queue.put_nowait((job, payload, size, time.monotonic()))
+            except asyncio.QueueFull:
+                self._reject(f"В очереди уже {self.max_pending} задач скана")
+            self.pending_bytes += size
+        self._jobs[job.id] = job
+        metrics.inc("scan_jobs_submitted")
+        return job
+
+    def get(self, job_id: str) -> Optional[ScanJobResponse]:
+        self._purge()
+        return self._jobs.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job, payload, size, enqueued_at = await self.queue.get()
+            started_at = time.monotonic()
+            self.wait_ms.observe((started_at - enqueued_at) * 1000)
+            job.status = JobStatus.running
+            try:
+                predict = await self.handler(payload)
+                job.result = ScanResponse(id=job.id, predict=predict)
+                self._finish(job, JobStatus.done)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка задачи скана {job.id}: {e}")
+                # HTTPException (например, битое фото) - текст в detail
+                job.error = str(getattr(e, "detail", None) or e)
+                self._finish(job, JobStatus.failed)
+            finally:
+                # Фото задачи больше не нужно, пока воркер ждёт следующую
+                payload = None
+                self.pending_bytes -= size
+                self.run_ms.observe((time.monotonic() - started_at) * 1000)
+                self.queue.task_done()
+
+    async def drain(self):
+        '''
+        Дожидается выполнения всех поставленных задач.
+        '''
+        if self.queue is not None and self._tasks:
+            await self.queue.join()
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        if self.qsize():
+            logger.info(f"Ожидание выполнения {self.qsize()} задач скана")
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.queue = None
+        logger.info("Очередь задач скана остановлена")
+
+
+scan_jobs = ScanJobQueue(
+    workers=SCAN_JOB_WORKERS,
+    max_pending=SCAN_JOB_MAX_PENDING,
+    max_pending_bytes=SCAN_JOB_MAX_PENDING_MB * 1024 * 1024,
+    max_stored=SCAN_JOB_MAX_STORED,
+    result_ttl=SCAN_JOB_RESULT_TTL,
+)
@@ -0,0 +1,82 @@
+import threading
+from typing import Callable, Dict, List, Sequence
+
+# Границы бакетов по умолчанию для размеров (батчей, очередей)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    '''
+    Простая гистограмма с фиксированными верхними границами бакетов.
+    '''
+
+    def __init__(self, buckets: Sequence[float] = SIZE_BUCKETS):
+        self.buckets: List[float] = sorted(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.count += 1
+            self.total += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            buckets = {
+                f"le_{bound:g}": count
+                for bound, count in zip(self.buckets, self.counts)
+            }
+            buckets["le_inf"] = self.counts[-1]
+            return {
+                "count": self.count,
+                "sum": self.total,
+                "avg": self.total / self.count if self.count else 0.0,
+                "buckets": buckets,
+            }
+
+
+class MetricsRegistry:
+    '''
+    Метрики процесса: счётчики, гистограммы и gauge-функции.
+    Отдаются в JSON на /metrics.
+    '''
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def histogram(self, name: str, buckets: Sequence[float] = SIZE_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            return self.histograms[name]
+
+    def gauge(self, name: str, func: Callable[[], float]):
+        self.gauges[name] = func
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "gauges": {name: func() for name, func in self.gauges.items()},
+            "histograms": {
+                name: histogram.snapshot()
+                for name, histogram in self.histograms.items()
+            },
+        }
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+import torch
+
+from clip.clip_inferense import ClipClassifier
+from segmentator.segmentator_inferense import load_yolo_model
+from settings import logger
+
+
+class ModelRegistry:
+    '''
+    Реестр ML моделей процесса.
+
+    Каждая модель загружается один раз (при старте приложения или при первом
+    обращении) и переиспользуется всеми запросами.
+    '''
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self.load_times: Dict[str, float] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        '''
+        Регистрирует функцию загрузки модели под именем name.
+        '''
+        self._loaders[name] = loader
+
+    def add_listener(self, callback: Callable[[str], None]):
+        '''
+        Подписывает callback(name) на загрузку моделей. Вызывается после
+        каждой (пере)загрузки, например для сброса кэшей, зависящих от весов.
+        '''
+        self._listeners.append(callback)
+
+    def get(self, name: str) -> Any:
+        '''
+        Возвращает загруженную модель, при необходимости загружая её.
+        '''
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                if name not in self._models:
+                    self._load(name)
+            model = self._models[name]
+        return model
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def load_all(self):
+        '''
+        Загружает все зарегистрированные модели.
+        '''
+        with self._lock:
+            for name in self._loaders:
+                if name not in self._models:
+                    self._load(name)
+
+    def share_memory(self):
+        '''
+        Переносит веса загруженных torch моделей в разделяемую память, чтобы
+        воркеры, созданные через fork, использовали одну копию весов.
+        '''
+        for name, model in self._models.items():
+            module = model if isinstance(model, torch.nn.Module) else getattr(model, "model", None)
+            if isinstance(module, torch.nn.Module):
+                module.share_memory()
+                logger.info(f"Веса модели {name} перенесены в разделяемую память")
+
+    def clear(self):
+        '''
+        Освобождает загруженные модели.
+        '''
+        with self._lock:
+            self._models.clear()
+            self.load_times.clear()
+
+    def _load(self, name: str):
+        if name not in self._loaders:
+            raise KeyError(f"Модель {name} не зарегистрирована")
+        start_time = time.time()
+        self._models[name] = self._loaders[name]()
+        self.load_times[name] = float(f"{time.time() - start_time:.3f}")
+        logger.info(
+            f"Модель {name} загружена за {self.load_times[name]:.3f} сек."
+        )
+        for callback in self._listeners:
+            try:
+                callback(name)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика загрузки модели {name}: {e}")
+
+
+registry = ModelRegistry()
+registry.register("detector", load_yolo_model)
+registry.register("classifier", ClipClassifier)
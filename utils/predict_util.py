@@ -1,69 +1,280 @@
+import asyncio
 import time
 
+import numpy as np
+import torch
 from fastapi import HTTPException
 
-from clip.clip_inferense import get_clip_predict
+from clip.embedding_cache import crop_embedding_cache
 from schemas.schemas import (
     Plant,
     Crop,
     PredictSchema,
     DetectorSchema,
 )
-from segmentator.segmentator_inferense import ObjectDetector
-from utils.s3_util import upload_file
-from settings import logger
+from segmentator.segmentator_inferense import (
+    ObjectDetector,
+    run_detection,
+)
+from segmentator.tiling import merge_tile_results, tile_regions
+from utils.batch_util import MicroBatcher
+from utils.executor_util import inference_executor
+from utils.image_util import DecodedImage
+from utils.models_util import registry
+from utils.encode_util import image_encoder
+from utils.metrics_util import metrics
+from utils.s3_util import is_upload_error, object_key, public_url, upload_files
+from utils.upload_util import upload_queue
+from settings import (
+    ANNOTATION_MODE,
+    CLIP_BATCH_MAX_SIZE,
+    CLIP_BATCH_MAX_WAIT_MS,
+    DETECTOR_BATCH_MAX_SIZE,
+    DETECTOR_BATCH_MAX_WAIT_MS,
+    DETECTOR_CONF,
+    DETECTOR_IMGSZ,
+    DETECTOR_IOU,
+    DETECTOR_MAX_TILES,
+    DETECTOR_TILE_OVERLAP,
+    DETECTOR_TILE_NMS_IOU,
+    DETECTOR_TILE_SIZE,
+    DETECTOR_TILING,
+    UPLOAD_MODE,
+    logger,
+)
+
+
+# Функции этапов инференса выполняются в inference_executor и должны быть
+# функциями уровня модуля (в режиме process они передаются через pickle).
+
+def process_detection(image: np.ndarray, result,
+                      render: bool = True) -> tuple[list, np.ndarray | None]:
+    """
+    Постобработка результата YOLO: кропы объектов и фото с рамками (BGR).
+    При render=False фото с рамками не рисуется. Кодирование в JPEG
+    выполняется отдельно в image_encoder.
+    """
+    detector = ObjectDetector()
+    detector.image = image
+    detector.set_results(result)
+    objects = detector.get_objects_with_crops(encode=False)
+    labeled_image = detector.labeled_image if objects and render else None
+    return objects, labeled_image
+
+
+def render_annotation(image: np.ndarray, result) -> np.ndarray | None:
+    """Отрисовка фото с рамками (отложенный режим)."""
+    detector = ObjectDetector()
+    detector.image = image
+    detector.set_results(result)
+    return detector.labeled_image
+
+
+def preprocess_crops(crops: list) -> tuple[list, list]:
+    """
+    Приведение BGR кропов к размеру входа CLIP (uint8) и ключи кропов
+    для crop_embedding_cache.
+    """
+    crop_preprocessor = registry.get("classifier").crop_preprocessor
+    images = [crop_preprocessor.resize(crop) for crop in crops]
+    return images, [crop_embedding_cache.key(image) for image in images]
+
+
+def score_crops(image_features: list) -> list:
+    """Сопоставление эмбеддингов кропов с банком промптов."""
+    return registry.get("classifier").score(torch.stack(image_features))
+
+
+def encode_crops_batch(images: list) -> list:
+    """Один проход энкодера изображений CLIP для батча из разных запросов."""
+    return registry.get("classifier").encode_batch(images)
+
+
+def detect_batch(images: list) -> list:
+    """Один вызов YOLO для изображений из разных запросов."""
+    return run_detection(registry.get("detector"), images, imgsz=DETECTOR_IMGSZ,
+                         iou=DETECTOR_IOU, conf=DETECTOR_CONF)
+
+
+detector_batcher = MicroBatcher(
+    name="detector",
+    process_batch=detect_batch,
+    max_batch_size=DETECTOR_BATCH_MAX_SIZE,
+    max_wait_ms=DETECTOR_BATCH_MAX_WAIT_MS,
+    executor=inference_executor,
+)
+
+clip_batcher = MicroBatcher(
+    name="clip",
+    process_batch=encode_crops_batch,
+    max_batch_size=CLIP_BATCH_MAX_SIZE,
+    max_wait_ms=CLIP_BATCH_MAX_WAIT_MS,
+    executor=inference_executor,
+)
+
+
+async def store_files(files: dict, request_id: str) -> dict:
+    """
+    Сохраняет файлы скана в S3 и возвращает их URL по ключам files.
+
+    UPLOAD_MODE=sync - файлы загружаются сразу (upload_files),
+    queue - ставятся в очередь отложенной загрузки, а URL по
+    детерминированным ключам возвращаются без ожидания загрузки.
+
+    Args:
+        files: {ключ: (имя файла, содержимое)}
+    """
+    if UPLOAD_MODE == "queue":
+        await upload_queue.put_many([
+            (object_key(request_id, filename), content)
+            for filename, content in files.values()
+        ])
+        return {
+            key: public_url(request_id, filename)
+            for key, (filename, _) in files.items()
+        }
+    return await upload_files(files, request_id)
+
+
+# Фоновые задачи отрисовки фото с рамками (ANNOTATION_MODE=background)
+annotation_tasks: set[asyncio.Task] = set()
 
 
-async def get_predict(image_content: bytes, request_id: str) -> PredictSchema:
-    """Главная ML функция."""
-    detect = await detect_plants(image_content, request_id=request_id)
+def annotated_filename(request_id: str) -> str:
+    return f"{request_id}_annotated.jpg"
+
+
+def crop_filename(obj: dict) -> str:
+    return f"object_{obj['id']}_{obj['class_name']}.jpg"
+
+
+async def annotate_in_background(image: np.ndarray, result, request_id: str):
+    """Рисует, кодирует и загружает фото с рамками после ответа клиенту."""
+    try:
+        labeled_image = await inference_executor.run(render_annotation, image, result)
+        annotated_image_bytes = None
+        if labeled_image is not None:
+            annotated_image_bytes = await image_encoder.encode(labeled_image, "annotated")
+        if not annotated_image_bytes:
+            raise RuntimeError("пустое изображение с разметкой")
+        urls = await store_files(
+            {"annotated": (annotated_filename(request_id), annotated_image_bytes)},
+            request_id,
+        )
+        if is_upload_error(urls["annotated"]):
+            raise RuntimeError(urls["annotated"])
+        metrics.inc("annotation_background_done")
+    except Exception as e:
+        metrics.inc("annotation_background_errors")
+        logger.error(f"Ошибка фоновой отрисовки фото с рамками {request_id}: {e}")
+        # URL уже отдан клиенту и мог попасть в кэш результатов
+        upload_queue.report_failure(object_key(request_id, annotated_filename(request_id)))
+
+
+def schedule_annotation(image: np.ndarray, result, request_id: str) -> str:
+    """
+    Ставит отрисовку фото с рамками в фон и сразу возвращает его URL.
+    """
+    task = asyncio.create_task(annotate_in_background(image, result, request_id))
+    annotation_tasks.add(task)
+    task.add_done_callback(annotation_tasks.discard)
+    return public_url(request_id, annotated_filename(request_id))
+
+
+async def drain_annotations():
+    """Дожидается фоновых отрисовок (при остановке сервиса)."""
+    if annotation_tasks:
+        logger.info(f"Ожидание {len(annotation_tasks)} фоновых отрисовок")
+        await asyncio.gather(*annotation_tasks, return_exceptions=True)
+
+
+async def get_predict(image: DecodedImage, request_id: str,
+                      framed: bool = True) -> PredictSchema:
+    """
+    Главная ML функция. Принимает фото, декодированное на входе запроса.
+    framed=False - фото с рамками не нужно клиенту и не рисуется.
+    """
+    annotate = ANNOTATION_MODE if framed else "skip"
+    detect = await detect_plants(image, request_id=request_id, annotate=annotate)
     crops = detect.crops
     logger.info(f"Нашел {len(crops)} растений, отправляю на определение.")
-    plants = []
-    for crop in crops:
-        plant = await get_plant_predict(crop.crop_bytes)
-        if plant:
-            plant.crop_url = crop.url_image
-            plants.append(plant)
+    plants = await get_plants_predict(crops)
     predict_response = PredictSchema(
         plants=plants,
         framed_url=detect.framed_url,
     )
     return predict_response
 
-async def detect_plants(image_content: bytes, request_id) -> DetectorSchema:
+async def detect_plants(image: DecodedImage, request_id,
+                        annotate: str = "sync") -> DetectorSchema:
     """
     Функция должна принять исходное фото и вернуть список с кропами, id всех
     найденных растений и фото с рамками найденных растений.
+
+    annotate: sync - фото с рамками рисуется и загружается до ответа,
+    background - после ответа (URL возвращается сразу), skip - не рисуется.
     """
     logger.info("Попытка найти растения")
-    detector = ObjectDetector()
-    detector.predict(
-        image_input=image_content,
+    if DETECTOR_TILING and max(image.array.shape[:2]) > DETECTOR_TILE_SIZE:
+        # Тайлы идут через detector_batcher, как и целые фото: детектор
+        # вызывается только из батчера (предиктор не потокобезопасен)
+        regions = tile_regions(image.array.shape, DETECTOR_TILE_SIZE,
+                               DETECTOR_TILE_OVERLAP, DETECTOR_MAX_TILES)
+        results = await detector_batcher.submit_many(
+            [image.array[y1:y2, x1:x2] for x1, y1, x2, y2 in regions]
+        )
+        logger.info(f"Тайловая детекция: {len(regions)} областей")
+        result = await inference_executor.run(
+            merge_tile_results, regions, results, image.array.shape,
+            iou_threshold=DETECTOR_TILE_NMS_IOU,
+        )
+    else:
+        result = await detector_batcher.submit(image.array)
+    objects, labeled_image = await inference_executor.run(
+        process_detection, image.array, result, annotate == "sync"
     )
-
-    objects = detector.get_objects_with_crops()
     logger.info(f"Найдено {len(objects)} растений.")
     if objects and len(objects) > 0:
-        annotated_image_bytes = detector.get_annotated_image_bytes()
-        annotated_url = await upload_file(
-            file_content=annotated_image_bytes,
-            filename=f"{request_id}_annotated.jpg",
-            request_id=request_id
-            )
-        crops = []
-        for obj in objects:
-            url = await upload_file(
-            file_content=obj["img_crop_bytes"],
-            filename=f"object_{obj['id']}_{obj['class_name']}.jpg",
-            request_id=request_id
+        # JPEG нужен только для загрузки, классификатор получает пиксели.
+        # Кропы и фото с рамками кодируются одновременно
+        crop_encodes = image_encoder.encode_many([obj["img_crop"] for obj in objects])
+        annotated_url = None
+        uploads = {}
+        if annotate == "sync":
+            annotated_image_bytes, crops_bytes = await asyncio.gather(
+                image_encoder.encode(labeled_image, "annotated"), crop_encodes
             )
-            crop = Crop(
-            id=obj["id"],
-            crop_bytes=obj["img_crop_bytes"],
-            url_image=url,
+            if annotated_image_bytes:
+                uploads["annotated"] = (annotated_filename(request_id),
+                                        annotated_image_bytes)
+            else:
+                logger.error("Ошибка кодирования фото с рамками")
+        else:
+            crops_bytes = await crop_encodes
+            if annotate == "background":
+                annotated_url = schedule_annotation(image.array, result, request_id)
+
+        encoded = []
+        for obj, crop_bytes in zip(objects, crops_bytes):
+            if crop_bytes is None:
+                logger.error(f"Ошибка кодирования изображения для объекта {obj['id']}")
+                continue
+            encoded.append((obj, crop_bytes))
+            uploads[obj["id"]] = (crop_filename(obj), crop_bytes)
+
+        # Все файлы запроса загружаются одновременно (или ставятся в очередь),
+        # ошибка загрузки одного файла не прерывает скан
+        urls = await store_files(uploads, request_id)
+        annotated_url = urls.get("annotated", annotated_url)
+        crops = [
+            Crop(
+                id=obj["id"],
+                crop_bytes=crop_bytes,
+                crop_image=obj["img_crop"],
+                url_image=urls[obj["id"]],
             )
-            crops.append(crop)
+            for obj, crop_bytes in encoded
+        ]
         plants = DetectorSchema(
             crops=crops,
             framed_url=annotated_url,
@@ -75,21 +286,45 @@ async def detect_plants(image_content: bytes, request_id) -> DetectorSchema:
             framed_url=None,
         )
 
-async def  get_plant_predict(crop_bytes: bytes) -> Plant | None:
+async def get_plants_predict(crops: list[Crop]) -> list[Plant]:
     """
-    Функция для получения предсказания породы растения на основе кропа растения.
-    ToDo Пока возвращает random из коллекции schemas.trees_dict
+    Функция для получения предсказания породы растений и их дефектов сразу
+    для всех кропов одного фото. Кропы кодируются через clip_batcher вместе
+    с кропами конкурентных запросов. Возвращает растения в порядке кропов.
     """
-    logger.info(f"Начинаю классифицировать растение и его дефекты")
+    if not crops:
+        return []
+    logger.info(f"Начинаю классифицировать {len(crops)} растений и их дефекты")
     start_time = time.time()
     try:
-        result = get_clip_predict(crop_bytes)
-        logger.info(f"result get plant predict: {result}")
-        result_time = time.time() - start_time
-        if len(result["plant"]) >= 0:
-            logger.info(
-                f"Определил растение как: {result['plant']['name']} за {result_time:.3f} сек."
+        images, keys = await inference_executor.run(
+            preprocess_crops, [crop.crop_image for crop in crops]
+        )
+        # Повторяющиеся кропы берутся из кэша и не проходят через энкодер.
+        # Поиск по расстоянию Хэмминга линеен по размеру кэша, поэтому идёт
+        # в потоке, а не в event loop
+        cached = await asyncio.to_thread(crop_embedding_cache.get_many, keys)
+        image_features = [
+            torch.from_numpy(features) if features is not None else None
+            for features in cached
+        ]
+        missing = [i for i, features in enumerate(image_features) if features is None]
+        if missing:
+            encoded = await clip_batcher.submit_many([images[i] for i in missing])
+            await asyncio.to_thread(
+                crop_embedding_cache.put_many,
+                [keys[i] for i in missing], [features.numpy() for features in encoded],
             )
+            for i, features in zip(missing, encoded):
+                image_features[i] = features
+        results = await inference_executor.run(score_crops, image_features)
+        result_time = time.time() - start_time
+        logger.info(
+            f"Классифицировал {len(crops)} растений за {result_time:.3f} сек."
+        )
+        plants = []
+        for crop, result in zip(crops, results):
+            logger.info(f"Определил растение как: {result['plant']['name']}")
             logger.info(result)
             plant = Plant(
                 id=1,
@@ -98,9 +333,10 @@ async def  get_plant_predict(crop_bytes: bytes) -> Plant | None:
                 confidence=result["plant"]["confidence"],
                 type=result["plant"]["type"],
                 defects=result["plant"]["defects"],
-                processing_time=float(f"{result_time:.3f}"),
+                processing_time=float(f"{result_time / len(crops):.3f}"),
+                crop_url=crop.url_image,
             )
-            return plant
-        return None
+            plants.append(plant)
+        return plants
     except Exception as e:
         raise HTTPException(500, e)
@@ -1,16 +1,20 @@
 import asyncio
 import uuid
+from typing import Dict, Hashable, Tuple
 from urllib.parse import urlparse
 
 import aioboto3
 import boto3
-from botocore.config import Config
+from aiobotocore.config import AioConfig
 from botocore.exceptions import ClientError, ConnectTimeoutError, \
     ReadTimeoutError
 from types_aiobotocore_s3.client import S3Client
 from settings import (AWS_ACCESS_KEY_ID, AWS_REGION_NAME,
                       AWS_SECRET_ACCESS_KEY, S3_BUCKET_NAME, S3_ENDPOINT_URL,
-                      logger, S3_PUBLIC_BUCKET)
+                      logger, S3_PUBLIC_BUCKET, S3_KEEPALIVE_TIMEOUT,
+                      S3_MAX_ATTEMPTS, S3_MAX_POOL_CONNECTIONS,
+                      S3_UPLOAD_CONCURRENCY)
+from utils.metrics_util import metrics
 
 
 
@@ -21,6 +25,70 @@ aiosession = aioboto3.Session(
     region_name=AWS_REGION_NAME,
 )
 
+
+class S3ClientManager:
+    '''
+    Долгоживущий асинхронный клиент S3 на всё приложение.
+
+    Клиент создаётся один раз (в lifespan) с пулом соединений
+    max_pool_connections, keep-alive и повторами botocore, поэтому загрузка
+    каждого файла - это один PUT по уже открытому соединению, без нового
+    TLS handshake и создания клиента. Если клиент не был запущен заранее,
+    он создаётся при первой загрузке. Одновременных загрузок в процессе
+    не больше S3_UPLOAD_CONCURRENCY (upload_slots).
+    '''
+
+    def __init__(self):
+        self.config = AioConfig(
+            connect_timeout=5,
+            read_timeout=30,
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+            tcp_keepalive=True,
+            connector_args={"keepalive_timeout": S3_KEEPALIVE_TIMEOUT},
+        )
+        self._client: S3Client | None = None
+        self._client_context = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock: asyncio.Lock | None = None
+        self.upload_slots: asyncio.Semaphore | None = None
+
+    async def start(self) -> S3Client:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Клиент привязан к event loop, в котором создан
+            self._client = None
+            self._lock = asyncio.Lock()
+            self.upload_slots = asyncio.Semaphore(S3_UPLOAD_CONCURRENCY)
+            self._loop = loop
+        async with self._lock:
+            if self._client is None:
+                self._client_context = aiosession.client(
+                    "s3",
+                    endpoint_url=S3_ENDPOINT_URL,
+                    config=self.config,
+                )
+                self._client = await self._client_context.__aenter__()
+                logger.info(
+                    f"Клиент S3 создан (пул {S3_MAX_POOL_CONNECTIONS} соединений)"
+                )
+        return self._client
+
+    async def get(self) -> S3Client:
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            return self._client
+        return await self.start()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client_context.__aexit__(None, None, None)
+            self._client = None
+            self._client_context = None
+            logger.info("Клиент S3 закрыт")
+
+
+s3_manager = S3ClientManager()
+
 # session = boto3.Session(
 #     aws_access_key_id=AWS_ACCESS_KEY_ID,
 #     aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
@@ -97,25 +165,34 @@ aiosession = aioboto3.Session(
 #         raise HTTPException(status_code=500, detail=error_msg)
 
 
+# Начало сообщения, которое возвращается вместо URL при ошибке загрузки
+UPLOAD_ERROR_PREFIX = "Изображение не было загружено"
+
+
+def is_upload_error(url: str | None) -> bool:
+    return url is not None and url.startswith(UPLOAD_ERROR_PREFIX)
+
+
+def object_key(request_id: uuid.UUID, filename: str) -> str:
+    """Ключ файла запроса в бакете."""
+    return f"{request_id}/{filename}"
+
+
+def public_url(request_id: uuid.UUID, filename: str) -> str:
+    """Публичный URL файла запроса в S3 (известен до загрузки)."""
+    return f"{S3_PUBLIC_BUCKET}/{object_key(request_id, filename)}"
+
+
 async def upload_file(
     filename: str,
     file_content: bytes,
     request_id: uuid.UUID,
 ) -> str:
-    s3_key =  f"{request_id}/{filename}"
-
-    config = Config(
-        connect_timeout=5,
-        read_timeout=30,
-    )
-
-    async with aiosession.client(
-            "s3",
-            endpoint_url=S3_ENDPOINT_URL,
-            config=config,
-    ) as s3:
-        s3: S3Client
-        try:
+    s3_key = object_key(request_id, filename)
+
+    try:
+        s3 = await s3_manager.get()
+        async with s3_manager.upload_slots:
             logger.info(f"Uploading {s3_key} to s3")
             try:
                 await s3.put_object(
@@ -124,18 +201,46 @@ async def upload_file(
                     Body=file_content,
                 )
                 logger.info(f"Finished Uploading {s3_key} to s3")
-                file_url = f"{S3_PUBLIC_BUCKET}/{s3_key}"
+                metrics.inc("s3_uploads")
+                file_url = public_url(request_id, filename)
                 return file_url
             except asyncio.TimeoutError:
                 logger.error(f"Upload operation timed out for {s3_key}")
-                return "Изображение не было загружено (таймаут)"
-
-        except (ConnectTimeoutError, ReadTimeoutError) as e:
-            logger.error(f"S3 connection timeout: {e}")
-            return "Изображение не было загружено (таймаут подключения)"
-        except ClientError as e:
-            logger.error(f"S3 client error: {e}")
-            return "Изображение не было загружено (ошибка S3)"
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
-            return "Изображение не было загружено"
+                metrics.inc("s3_upload_errors")
+                return f"{UPLOAD_ERROR_PREFIX} (таймаут)"
+
+    except (ConnectTimeoutError, ReadTimeoutError) as e:
+        logger.error(f"S3 connection timeout: {e}")
+        metrics.inc("s3_upload_errors")
+        return f"{UPLOAD_ERROR_PREFIX} (таймаут подключения)"
+    except ClientError as e:
+        logger.error(f"S3 client error: {e}")
+        metrics.inc("s3_upload_errors")
+        return f"{UPLOAD_ERROR_PREFIX} (ошибка S3)"
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        metrics.inc("s3_upload_errors")
+        return UPLOAD_ERROR_PREFIX
+
+
+async def upload_files(
+    files: Dict[Hashable, Tuple[str, bytes]],
+    request_id: uuid.UUID,
+) -> Dict[Hashable, str]:
+    """
+    Загружает файлы одного запроса одновременно (не больше
+    S3_UPLOAD_CONCURRENCY загрузок на процесс).
+
+    Args:
+        files: {ключ (например id объекта): (имя файла, содержимое)}
+        request_id: ID запроса
+
+    Returns:
+        {ключ: URL}. Для файла, который не удалось загрузить, вместо URL
+        сообщение об ошибке, остальные файлы при этом загружаются.
+    """
+    urls = await asyncio.gather(*(
+        upload_file(filename=filename, file_content=content, request_id=request_id)
+        for filename, content in files.values()
+    ))
+    return dict(zip(files.keys(), urls))
@@ -0,0 +1,94 @@
+import asyncio
+from typing import Optional
+
+from clip.embedding_cache import crop_embedding_cache
+from settings import (
+    CACHE_SNAPSHOT_DIR,
+    CACHE_SNAPSHOT_INTERVAL,
+    CLIP_MODEL_NAME,
+    CLIP_WEIGHTS_PATH,
+    logger,
+)
+from utils.cache_util import result_cache, weights_hash
+from utils.metrics_util import metrics
+
+
+def crop_cache_version() -> str:
+    '''
+    Версия снимка эмбеддингов кропов: веса и модель CLIP, способ хэширования.
+    '''
+    return (
+        f"{weights_hash(CLIP_WEIGHTS_PATH)}:{CLIP_MODEL_NAME}:"
+        f"{crop_embedding_cache.tolerance}"
+    )
+
+
+class CacheSnapshotter:
+    '''
+    Периодическое сохранение кэшей процесса на диск и их восстановление при
+    старте, чтобы после рестарта или деплоя сервис не начинал с холодных
+    кэшей. Снимки другой версии моделей не восстанавливаются.
+    '''
+
+    def __init__(self, directory: str, interval: float = 600):
+        self.directory = directory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def save_all(self):
+        if not self.enabled:
+            return
+        crops = crop_embedding_cache.snapshot(self.directory, crop_cache_version())
+        results = result_cache.snapshot(self.directory)
+        metrics.inc("cache_snapshots")
+        logger.info(
+            f"Снимок кэшей сохранён в {self.directory}: "
+            f"{crops} эмбеддингов кропов, {results} результатов"
+        )
+
+    def restore_all(self):
+        if not self.enabled:
+            return
+        crops = crop_embedding_cache.restore(self.directory, crop_cache_version())
+        results = result_cache.restore(self.directory)
+        logger.info(
+            f"Снимок кэшей восстановлен из {self.directory}: "
+            f"{crops} эмбеддингов кропов, {results} результатов"
+        )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.save_all)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения снимка кэшей: {e}")
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.restore_all)
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        '''
+        Останавливает периодическое сохранение и сохраняет финальный снимок.
+        '''
+        if not self.enabled:
+            return
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.to_thread(self.save_all)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения снимка кэшей: {e}")
+
+
+cache_snapshotter = CacheSnapshotter(CACHE_SNAPSHOT_DIR, CACHE_SNAPSHOT_INTERVAL)
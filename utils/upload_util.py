@@ -0,0 +1,243 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from settings import (
+    S3_BUCKET_NAME,
+    UPLOAD_LOCAL_DIR,
+    UPLOAD_MAX_ATTEMPTS,
+    UPLOAD_QUEUE_MAX_MB,
+    UPLOAD_QUEUE_WORKERS,
+    UPLOAD_RETRY_BASE_MS,
+    UPLOAD_STORAGE,
+    logger,
+)
+from utils.metrics_util import metrics
+from utils.s3_util import s3_manager
+
+# Бакеты гистограммы времени от постановки в очередь до загрузки, мс
+UPLOAD_MS_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class S3Storage:
+    '''
+    Загрузка в S3 через общий клиент s3_manager. В отличие от upload_file
+    ошибки не подавляются, чтобы очередь могла повторить загрузку.
+    '''
+
+    async def put(self, key: str, content: bytes):
+        s3 = await s3_manager.get()
+        async with s3_manager.upload_slots:
+            await s3.put_object(Bucket=S3_BUCKET_NAME, Key=key, Body=content)
+
+
+class LocalStorage:
+    '''
+    Запись файлов в локальную директорию вместо S3 (разработка, тесты).
+    '''
+
+    def __init__(self, root_dir: str):
+        self.root_dir = Path(root_dir)
+
+    def _write(self, key: str, content: bytes):
+        path = self.root_dir / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+
+    async def put(self, key: str, content: bytes):
+        await asyncio.to_thread(self._write, key, content)
+
+
+class MemoryStorage:
+    '''
+    Хранение файлов в памяти процесса (тесты).
+    '''
+
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+
+    async def put(self, key: str, content: bytes):
+        self.files[key] = content
+
+
+def create_storage(kind: str = UPLOAD_STORAGE):
+    if kind == "s3":
+        return S3Storage()
+    if kind == "local":
+        return LocalStorage(UPLOAD_LOCAL_DIR)
+    if kind == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище загрузок {kind}, ожидается s3, local или memory")
+
+
+class UploadQueue:
+    '''
+    Очередь отложенной (write-behind) загрузки файлов.
+
+    Скан отдаёт URL по детерминированным ключам сразу, а bytes кладёт в
+    очередь, которую разбирают воркеры. Неудачные загрузки повторяются с
+    экспоненциальной задержкой, о файлах, которые так и не загрузились,
+    сообщается подписчикам (add_failure_listener). Суммарный размер файлов
+    в очереди ограничен max_bytes: put ждёт освобождения места
+    (backpressure).
+    При остановке очередь дожидается загрузки всех файлов.
+    '''
+
+    def __init__(
+        self,
+        storage=None,
+        workers: int = 8,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_attempts: int = 5,
+        retry_base_ms: float = 200,
+    ):
+        '''
+        Args:
+            storage: хранилище с методом async put(key, content)
+            workers: количество воркеров загрузки
+            max_bytes: бюджет памяти на файлы в очереди
+            max_attempts: попыток загрузки одного файла
+            retry_base_ms: задержка перед первым повтором, далее удваивается
+        '''
+        self.storage = storage
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base_ms / 1000
+        self.pending_bytes = 0
+        self.queue: Optional[asyncio.Queue] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._failure_listeners: List[Callable[[str], None]] = []
+
+        self.latency = metrics.histogram("upload_queue_latency_ms", UPLOAD_MS_BUCKETS)
+        metrics.gauge("upload_queue_depth", self.qsize)
+        metrics.gauge("upload_queue_bytes", lambda: self.pending_bytes)
+
+    def qsize(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def add_failure_listener(self, callback: Callable[[str], None]):
+        '''
+        Подписывает callback(key) на неудачные загрузки, например для
+        удаления из кэша результатов со ссылками на незагруженный файл.
+        '''
+        self._failure_listeners.append(callback)
+
+    def report_failure(self, key: str):
+        '''
+        Сообщает подписчикам, что файл key не загружен. Вызывается и для
+        загрузок вне очереди (фоновая отрисовка в режиме sync).
+        '''
+        for callback in self._failure_listeners:
+            try:
+                callback(key)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика неудачной загрузки {key}: {e}")
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        if self.storage is None:
+            self.storage = create_storage()
+        self._loop = loop
+        self.queue = asyncio.Queue()
+        self._space = asyncio.Condition()
+        self.pending_bytes = 0
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+        logger.info(
+            f"Очередь загрузок запущена: {self.workers} воркеров, "
+            f"{type(self.storage).__name__}"
+        )
+
+    async def put(self, key: str, content: bytes):
+        '''
+        Ставит файл в очередь. Если бюджет памяти исчерпан, ждёт, пока
+        воркеры загрузят уже поставленные файлы.
+        '''
+        await self.start()
+        size = len(content)
+        async with self._space:
+            # Файл больше всего бюджета допускается только в пустую очередь
+            await self._space.wait_for(
+                lambda: self.pending_bytes + size <= self.max_bytes
+                or self.pending_bytes == 0
+            )
+            self.pending_bytes += size
+        metrics.inc("upload_queue_enqueued")
+        await self.queue.put((key, content, time.monotonic()))
+
+    async def put_many(self, files: List[Tuple[str, bytes]]):
+        for key, content in files:
+            await self.put(key, content)
+
+    async def _upload(self, key: str, content: bytes) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.storage.put(key, content)
+                return True
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    logger.error(
+                        f"Не удалось загрузить {key} за {attempt} попыток: {e}"
+                    )
+                    return False
+                metrics.inc("upload_queue_retries")
+                delay = self.retry_base * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Ошибка загрузки {key} (попытка {attempt}): {e}, "
+                    f"повтор через {delay:.2f} сек."
+                )
+                await asyncio.sleep(delay)
+        return False
+
+    async def _worker(self):
+        while True:
+            key, content, enqueued_at = await self.queue.get()
+            try:
+                if await self._upload(key, content):
+                    metrics.inc("upload_queue_done")
+                    self.latency.observe((time.monotonic() - enqueued_at) * 1000)
+                else:
+                    metrics.inc("upload_queue_failed")
+                    self.report_failure(key)
+            finally:
+                async with self._space:
+                    self.pending_bytes -= len(content)
+                    self._space.notify_all()
+                self.queue.task_done()
+
+    async def drain(self):
+        '''
+        Дожидается загрузки всех файлов, поставленных в очередь.
+        '''
+        if self.queue is not None and self._tasks:
+            await self.queue.join()
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        if self.qsize():
+            logger.info(f"Ожидание загрузки {self.qsize()} файлов из очереди")
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Очередь загрузок остановлена")
+
+
+upload_queue = UploadQueue(
+    workers=UPLOAD_QUEUE_WORKERS,
+    max_bytes=UPLOAD_QUEUE_MAX_MB * 1024 * 1024,
+    max_attempts=UPLOAD_MAX_ATTEMPTS,
+    retry_base_ms=UPLOAD_RETRY_BASE_MS,
+)